@@ -1,17 +1,92 @@
+import os
 import zlib
 import struct
 from .memreader import MemoryReader
+from .profiling import phase
+
+CHUNK_SIZE = 1 << 20
 
 def compress_data(in_data, compression):
     out_data = zlib.compress(in_data, compression)
     return out_data
 
 def decompress_data(in_data):
-    try:
-        out_data = zlib.decompress(in_data)
-        return out_data
-    except:
-        return b''
+    # raises zlib.error on corrupted input instead of producing an empty file
+    return zlib.decompress(in_data)
+
+def iter_chunks(source, chunk_size=CHUNK_SIZE):
+    """ Yields consecutive chunks of a binary stream or of a buffer (as views). """
+    if hasattr(source, 'read'):
+        chunk = source.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = source.read(chunk_size)
+    else:
+        view = memoryview(source).cast('B')
+        for pos in range(0, len(view), chunk_size):
+            yield view[pos:pos + chunk_size]
+
+def compress_segments(segments, compression=9, output=None, chunk_size=CHUNK_SIZE):
+    """ Deflates the buffers as a single zlib stream, chunk by chunk.
+
+    Writes to the binary stream `output` and returns the compressed size, or
+    returns the compressed bytes when no output is given.
+    """
+    compressor = zlib.compressobj(compression)
+    pieces = []
+    write = pieces.append if output is None else output.write
+    total = 0
+    with phase('zlib.compress') as timed:
+        consumed = 0
+        for segment in segments:
+            for chunk in iter_chunks(segment, chunk_size):
+                consumed += len(chunk)
+                block = compressor.compress(chunk)
+                if block:
+                    total += len(block)
+                    write(block)
+        block = compressor.flush()
+        total += len(block)
+        write(block)
+        timed.nbytes = consumed
+    return b''.join(pieces) if output is None else total
+
+def iter_decompress(source, chunk_size=CHUNK_SIZE):
+    """ Yields inflated chunks of at most `chunk_size` bytes from a buffer or stream. """
+    decompressor = zlib.decompressobj()
+    for chunk in iter_chunks(source, chunk_size):
+        block = decompressor.decompress(chunk, chunk_size)
+        while block:
+            yield block
+            block = decompressor.decompress(decompressor.unconsumed_tail, chunk_size)
+        if decompressor.eof:
+            break
+    block = decompressor.flush()
+    if block:
+        yield block
+    if not decompressor.eof:
+        raise zlib.error("Truncated compressed stream")
+
+def decompress_into(source, out=None, offset=0, chunk_size=CHUNK_SIZE):
+    """ Inflates into the writable buffer `out` starting at `offset`.
+
+    Without `out` a growing bytearray is used. Returns (buffer, end position).
+    """
+    if out is None:
+        out = bytearray()
+        for block in iter_decompress(source, chunk_size):
+            out += block
+        return out, len(out)
+
+    view = memoryview(out).cast('B')
+    pos = offset
+    for block in iter_decompress(source, chunk_size):
+        end = pos + len(block)
+        if end > len(view):
+            raise ValueError(f"Decompressed data exceeds the {len(view)} bytes buffer")
+        view[pos:end] = block
+        pos = end
+    return out, pos
 
 def read_c_string(stream, encoding=None):
     if encoding is None:
@@ -40,6 +115,55 @@ def read_bytes(stream, count):
 def write_bytes(stream, data):
     stream.write(data)
 
+def is_path(output):
+    return isinstance(output, (str, os.PathLike))
+
+def write_via_temp(path, write):
+    """ Calls `write(stream)` on `path + '.tmp'` and moves the result over `path`.
+
+    The target is only replaced once complete, so it may be the (mapped)
+    source being exported; on failure the temporary file is removed.
+    Returns what `write` returns.
+    """
+    temp = os.fspath(path) + '.tmp'
+    try:
+        with open(temp, 'wb') as stream:
+            result = write(stream)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    return result
+
+def write_segments(stream, segments):
+    """ Writes buffers in order, with a single writev() when the stream is a real file. """
+    segments = [memoryview(segment).cast('B') for segment in segments if len(segment)]
+    total = sum(len(segment) for segment in segments)
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError):
+        fd = None
+    if fd is None or not hasattr(os, 'writev'):
+        for segment in segments:
+            stream.write(segment)
+        return total
+
+    stream.flush()
+    iov_max = os.sysconf('SC_IOV_MAX') if 'SC_IOV_MAX' in os.sysconf_names else 1024
+    while segments:
+        written = os.writev(fd, segments[:iov_max])
+        # drop fully written buffers and trim a partially written one
+        while segments and written >= len(segments[0]):
+            written -= len(segments.pop(0))
+        if written:
+            segments[0] = segments[0][written:]
+    if stream.seekable():
+        stream.seek(0, 2)
+    return total
+
 def read_struct(stream, struct_type):
     _buffer = stream.read(struct.calcsize(struct_type))
     return struct.unpack(struct_type, _buffer)
@@ -48,6 +172,8 @@ def write_struct(stream, struct_type, struct_data):
     _buffer = struct.pack(struct_type, *struct_data)
     stream.write(_buffer)
 
+PSB_HEADER_FORMAT = '<4sIIIIIIIII'
+
 class PSBHeader:
     def __init__(self):
         self.signature = 0
@@ -62,22 +188,8 @@ class PSBHeader:
         self.res_index_tree = 0
 
     def read_from_stream(self, reader: MemoryReader):
-        self.signature = reader.read_bytes(4)
-        self.version = reader.read_uint32()
-        self.name_off_pos = reader.read_uint32()
-        self.name_data_pos = reader.read_uint32()
-        self.str_off_pos = reader.read_uint32()
-        self.str_data_pos = reader.read_uint32()
-        self.res_off_pos = reader.read_uint32()
-        self.res_data_pos = reader.read_uint32()
-        self.res_len_pos = reader.read_uint32()
-        self.res_index_tree = reader.read_uint32()
-
-    @classmethod
-    def from_bytes(cls, data):
-        header = cls()
-        header.signature,
-        header.version,
+        (self.signature,
+        self.version,
         self.name_off_pos,
         self.name_data_pos,
         self.str_off_pos,
@@ -85,12 +197,17 @@ class PSBHeader:
         self.res_off_pos,
         self.res_data_pos,
         self.res_len_pos,
-        header.res_index_tree = struct.unpack('<4sIIIIIIIII', data)
+        self.res_index_tree) = reader.read_struct(PSB_HEADER_FORMAT)
+
+    @classmethod
+    def from_bytes(cls, data):
+        header = cls()
+        header.read_from_stream(MemoryReader(data))
         return header
 
     def to_bytes(self):
         return struct.pack(
-            '<4sIIIIIIIII',
+            PSB_HEADER_FORMAT,
             self.signature,
             self.version,
             self.name_off_pos,
@@ -0,0 +1,203 @@
+import os
+import sys
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from .profiling import PhaseProfiler
+
+class BatchResult:
+    def __init__(self, path, value=None, error=None):
+        self.path = path
+        self.value = value
+        self.error = error
+        self.profile = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def skipped(self):
+        return self.ok and self.value is None
+
+    @property
+    def peak_memory(self):
+        """ Allocation peak of the job in bytes, when it ran profiled. """
+        if self.profile and 'file' in self.profile:
+            return self.profile['file']['peak_memory']
+        return None
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+def memory_estimate(path, factor, size_of=file_size):
+    """ Estimated peak memory of a job on `path`: `factor` times `size_of(path)`.
+
+    A tool's factor is the 'file' phase peak of its `--profile` output divided
+    by the size, measured on the benchmark fixtures.
+    """
+    return size_of(path) * factor
+
+def largest_first(files):
+    """ Indexes of `files` ordered by size, biggest first, so long jobs don't stretch the tail. """
+    return sorted(range(len(files)), key=lambda i: file_size(files[i]), reverse=True)
+
+def run_task(function, path, args=(), profile=False):
+    """ Runs one file job, turning any exception into a failed result.
+
+    With `profile`, the job runs under a memory tracing `PhaseProfiler` whose
+    phases end up in the result's `profile`.
+    """
+    try:
+        if not profile:
+            return BatchResult(path, function(path, *args))
+        with PhaseProfiler(trace_memory=True) as profiler:
+            with profiler.phase('file', file_size(path)):
+                result = BatchResult(path, function(path, *args))
+        result.profile = profiler.to_dict()
+        return result
+    except Exception:
+        return BatchResult(path, error=traceback.format_exc())
+
+def print_progress(result, done, total):
+    if result.skipped:
+        return
+    if result.ok:
+        peak = f" (peak {result.peak_memory / 1e6:.1f} MB)" if result.peak_memory is not None else ""
+        print(f"[{done}/{total}] {result.path}: {result.value}{peak}")
+    else:
+        message = result.error.strip().splitlines()[-1]
+        print(f"[{done}/{total}] {result.path}: FAILED {message}")
+        print(result.error, file=sys.stderr)
+
+WORKER_DIED = "BrokenProcessPool: the worker process died (killed or crashed) while running this file\n"
+
+def run_pool(function, files, args, profile, pending, workers, memory_budget, collect):
+    """ Runs the (index, cost) items of `pending` on a new process pool, taking
+    them off the list as they start and passing results to `collect`.
+
+    Returns the items that were in flight if a worker process died; the
+    pool is unusable then and the rest of `pending` is left for a new one.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        in_flight = 0
+        while pending or futures:
+            # strictly biggest first: when the next file doesn't fit in the
+            # budget, wait for running ones instead of starting smaller files
+            while pending and len(futures) < workers:
+                index, cost = item = pending[0]
+                if memory_budget and futures and in_flight + cost > memory_budget:
+                    break
+                try:
+                    future = pool.submit(run_task, function, files[index], args, profile)
+                except BrokenProcessPool:
+                    return list(futures.values())
+                del pending[0]
+                in_flight += cost
+                futures[future] = item
+            finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+            broken = []
+            for future in finished:
+                index, cost = item = futures.pop(future)
+                in_flight -= cost
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    broken.append(item)
+                    continue
+                except Exception:
+                    # the result couldn't be sent back (e.g. not picklable)
+                    result = BatchResult(files[index], error=traceback.format_exc())
+                collect(index, result)
+            if broken:
+                return broken + list(futures.values())
+    return []
+
+def run_batch(function, files, args=(), jobs=1, report=print_progress, profile=False,
+        memory_budget=None, memory_of=file_size):
+    """ Runs `function(path, *args)` for every file and returns the results in input order.
+
+    `function` must be a module level (picklable) callable; its return value is
+    the result value (None for skipped files). `jobs` is the number of worker
+    processes, 0 or None for one per CPU. `report(result, done, total)` is
+    called in this process as results come in. `profile` records per-phase
+    timings of every file (see `run_task`).
+
+    With `memory_budget` (bytes), files are started in order only while the
+    estimates `memory_of(path)` of the files in flight stay within it; a
+    file bigger than the whole budget runs alone.
+
+    A worker process that dies (e.g. OOM killed) only fails its own file:
+    the other files it took down with the pool are run again.
+    """
+    files = list(files)
+    if not jobs:
+        jobs = os.cpu_count() or 1
+    total = len(files)
+    order = largest_first(files)
+    results = [None] * total
+    done = 0
+
+    def collect(index, result):
+        nonlocal done
+        results[index] = result
+        done += 1
+        if report:
+            report(result, done, total)
+
+    if jobs == 1 or total < 2:
+        for index in order:
+            collect(index, run_task(function, files[index], args, profile))
+    else:
+        workers = min(jobs, total)
+        costs = [memory_of(files[index]) if memory_budget else 0 for index in order]
+        pending = list(zip(order, costs))
+        while pending:
+            for index, cost in run_pool(function, files, args, profile, pending, workers, memory_budget, collect):
+                # rerun alone what was in flight when a worker died: only the
+                # file that kills its worker again is the one to blame
+                if run_pool(function, files, args, profile, [(index, cost)], 1, None, collect):
+                    collect(index, BatchResult(files[index], error=WORKER_DIED))
+
+    return results
+
+def exit_status(results):
+    """ 0 when every file succeeded (or was skipped), 1 otherwise. """
+    return 0 if all(result.ok for result in results) else 1
+
+def run_incremental_batch(function, files, manifest, inputs_of, args=(), jobs=1, force=False, report=print_progress, profile=False,
+        memory_budget=None, memory_of=file_size):
+    """ Like `run_batch`, but skips files whose inputs didn't change since the
+    last run recorded in `manifest` (a `PackManifest`).
+
+    `inputs_of(path)` returns the (translation path, output path) of a file.
+    Skipped files get a result with a None value.
+    """
+    files = list(files)
+    results = [None] * len(files)
+    pending = []
+    for index, path in enumerate(files):
+        translation, output = inputs_of(path)
+        hashes = manifest.input_hashes(path, translation)
+        if not force and manifest.is_current(path, hashes, output):
+            results[index] = BatchResult(path)
+        else:
+            pending.append((index, hashes, output))
+
+    if report and len(pending) < len(files):
+        print(f"{len(files) - len(pending)} unchanged file(s) skipped")
+
+    built = run_batch(function, [files[index] for index, _, _ in pending], args, jobs, report, profile,
+        memory_budget, memory_of)
+    for (index, hashes, output), result in zip(pending, built):
+        results[index] = result
+        if not result.ok:
+            manifest.remove(result.path)
+        elif result.value is not None:
+            manifest.update(result.path, hashes, output)
+    manifest.save()
+    return results
@@ -0,0 +1,2 @@
+from .fixtures import build_psb, build_mdf, build_tjs2, build_bitmap, PSBBuilder
+from .runner import CASES, TIERS, run_benchmarks
@@ -0,0 +1,39 @@
+import json
+import sys
+from .runner import CASES, TIERS, run_benchmarks
+
+def print_result(result):
+    if 'error' in result:
+        print(f"{result['tier']:>6} {result['case']:<22} ERROR {result['error']}", file=sys.stderr)
+    else:
+        rate = f"{result['mb_per_s']:9.2f} MB/s" if result['mb_per_s'] is not None else ' ' * 14
+        strings = f" {result['strings_per_s']:12.0f} strings/s" if result['strings_per_s'] else ''
+        print(f"{result['tier']:>6} {result['case']:<22} {result['seconds']:9.4f}s {rate}"
+            f" peak {result['peak_memory'] / 1e6:8.2f} MB{strings}", file=sys.stderr)
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description='psbtool_py benchmarks over synthetic fixtures')
+    parser.add_argument('--tiers', default='small', help='Comma separated tiers: ' + ','.join(TIERS))
+    parser.add_argument('--cases', default=None, help='Comma separated cases: ' + ','.join(case.name for case in CASES))
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per case (best is kept)')
+    parser.add_argument('-o', '--output', default=None, help='JSON output file (stdout by default)')
+    args = parser.parse_args()
+
+    tiers = args.tiers.split(',')
+    for tier in tiers:
+        if tier not in TIERS:
+            parser.error(f"unknown tier {tier}")
+    cases = args.cases.split(',') if args.cases else None
+
+    report = run_benchmarks(tiers, cases, args.repeat, print_result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1)
+    else:
+        json.dump(report, sys.stdout, indent=1)
+        print()
+
+if __name__ == '__main__':
+    main()
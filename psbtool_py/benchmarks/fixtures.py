@@ -0,0 +1,208 @@
+""" Synthetic PSB, MDF, TJS2 and bitmap fixtures for the benchmarks. """
+import random
+import struct
+from .. import intarray
+from ..algorithms import PSBHeader
+from ..mdf import compress_mdf
+from ..psbtype import PSBType, PSB_SIGNATURE
+from ..tjs2scanner import TYPE_STRING, VMCode
+
+SPEAKERS = ["", "Narrator", "Alice", "Bob", "……", "？？？"]
+WORDS = ["the", "door", "opens", "slowly", "and", "light", "spills", "into", "room",
+    "彼女", "は", "静か", "に", "微笑んだ", "。", "「", "」", "……"]
+
+def make_strings(count, rnd, duplicates=0.2):
+    """ Scenario-like lines; about `duplicates` of them repeat speaker names and short labels. """
+    strings = [""]
+    while len(strings) < count:
+        if rnd.random() < duplicates:
+            strings.append(rnd.choice(SPEAKERS[1:]))
+        else:
+            strings.append(" ".join(rnd.choice(WORDS) for _ in range(rnd.randint(2, 24))))
+    return strings[:count]
+
+def encode_int(value):
+    length = intarray.min_int_len(value)
+    return bytes([PSBType.INTEGER_N + length]) + value.to_bytes(length, 'little')
+
+def encode_string_ref(string_id):
+    length = max(intarray.min_int_len(string_id), 1)
+    return bytes([PSBType.STRING_N + length]) + string_id.to_bytes(length, 'little')
+
+def encode_container(children, names=None):
+    """ LIST (no names) or OBJECT (with key name indices) with an offsets table. """
+    offsets = []
+    position = 0
+    for child in children:
+        offsets.append(position)
+        position += len(child)
+    data = bytearray()
+    if names is None:
+        data.append(PSBType.LIST)
+    else:
+        data.append(PSBType.OBJECT)
+        data += intarray.build_int_array(names, max(intarray.min_int_len(max(names, default=0)), 1))
+    data += intarray.build_int_array(offsets, max(intarray.min_int_len(position), 1))
+    for child in children:
+        data += child
+    return bytes(data)
+
+class PSBBuilder:
+    """ Builds a PSB whose bytecode references every string at least once.
+
+    `depth` nests scenes in lists of objects, `offset_width` forces the string
+    offset table width (minimal when None) and resources are random blobs.
+    """
+    def __init__(self, string_count=1000, depth=3, offset_width=None,
+            resource_count=0, resource_size=4096, seed=0):
+        self.rnd = random.Random(seed)
+        self.strings = make_strings(string_count, self.rnd)
+        self.depth = depth
+        self.offset_width = offset_width
+        self.resources = [self.make_resource(resource_size) for _ in range(resource_count)]
+
+    def make_resource(self, size):
+        # repeated runs make resources compressible like real textures
+        data = bytearray()
+        while len(data) < size:
+            data += bytes([self.rnd.randrange(256)]) * self.rnd.randint(1, 64)
+        return bytes(data[:size])
+
+    def build_value(self, ids, depth):
+        rnd = self.rnd
+        if depth == 0 or len(ids) <= 4:
+            children = []
+            for string_id in ids:
+                children.append(encode_string_ref(string_id))
+                kind = rnd.random()
+                if kind < 0.3:
+                    children.append(encode_int(rnd.randrange(1 << 16)))
+                elif kind < 0.4:
+                    children.append(bytes([PSBType.FLOAT]) + struct.pack('<f', rnd.random()))
+                elif kind < 0.45:
+                    children.append(bytes([PSBType.TRUE]))
+            return encode_container(children, list(range(len(children))))
+        parts = rnd.randint(2, 6)
+        step = (len(ids) + parts - 1) // parts
+        return encode_container([self.build_value(ids[i:i + step], depth - 1)
+            for i in range(0, len(ids), step)])
+
+    def build(self):
+        ids = list(range(len(self.strings)))
+        # scenarios reference strings roughly in order, with some repeats
+        for _ in range(len(ids) // 10):
+            ids.insert(self.rnd.randrange(len(ids)), self.rnd.randrange(len(self.strings)))
+        code = self.build_value(ids, self.depth)
+
+        names = intarray.build_int_array(list(range(8)), 1)
+        string_data = bytearray()
+        offsets = []
+        for string in self.strings:
+            offsets.append(len(string_data))
+            string_data += string.encode('utf-8') + b'\0'
+        offset_width = self.offset_width or intarray.min_int_len(offsets[-1])
+        string_table = intarray.build_int_array(offsets, offset_width)
+
+        resource_offsets = []
+        resource_data = bytearray()
+        for resource in self.resources:
+            resource_offsets.append(len(resource_data))
+            resource_data += resource
+        resource_table = intarray.build_int_array(resource_offsets, 4)
+        length_table = intarray.build_int_array([len(res) for res in self.resources], 4)
+
+        header = PSBHeader()
+        header.signature = PSB_SIGNATURE
+        header.version = 2
+        header.name_off_pos = 0x28
+        header.name_data_pos = 0x28
+        header.res_index_tree = header.name_off_pos + len(names)
+        header.str_off_pos = header.res_index_tree + len(code)
+        header.str_data_pos = header.str_off_pos + len(string_table)
+        header.res_off_pos = header.str_data_pos + len(string_data)
+        # field names follow PSBHeader: 0x1C holds the sizes table, 0x20 the data
+        header.res_data_pos = header.res_off_pos + len(resource_table)
+        header.res_len_pos = header.res_data_pos + len(length_table)
+        return b''.join([header.to_bytes(), names, code, string_table, string_data,
+            resource_table, length_table, resource_data])
+
+def build_psb(string_count=1000, **options):
+    """ Returns (psb bytes, strings, resources). """
+    builder = PSBBuilder(string_count, **options)
+    return builder.build(), builder.strings, builder.resources
+
+def build_mdf(psb, compression=9):
+    return bytes(compress_mdf(psb, compression))
+
+def tjs2_array(count, item_size, rnd):
+    data = struct.pack('<I', count) + bytes(rnd.randrange(256) for _ in range(count * item_size))
+    return data + b'\0' * (-len(data) % 4)
+
+def tjs2_sector(name, content):
+    return name.encode('ascii') + struct.pack('<I', len(content)) + content
+
+def tjs2_code_object(rnd, string_count, code_size):
+    """ A code object whose instructions load, read and call through string constants. """
+    slots = [(TYPE_STRING, rnd.randrange(min(string_count, 1 << 16))) for _ in range(max(code_size // 16, 1))]
+    slots.append((8, 0)) # an integer constant
+    code = []
+    while len(code) < code_size:
+        slot = rnd.randrange(len(slots))
+        kind = rnd.random()
+        if kind < 0.4:
+            code += [VMCode.CONST, rnd.randrange(8), slot]
+        elif kind < 0.6:
+            code += [VMCode.GPD, 1, 2, slot]
+        elif kind < 0.7:
+            code += [VMCode.SPD, 1, slot, 2]
+        elif kind < 0.8:
+            argc = rnd.randrange(-1, 3)
+            code += [VMCode.CALLD, 0, 1, slot, argc] + [3] * max(argc, 0)
+        elif kind < 0.9:
+            code += [VMCode.ADD, 1, 2]
+        else:
+            code += [VMCode.JF, 4]
+    code.append(VMCode.RET)
+    name = rnd.randrange(string_count) if rnd.random() < 0.5 else -1
+    data = struct.pack('<12i', -1, name, 0, 8, 0, 8, 0, -1, -1, -1, -1, -1)
+    data += struct.pack('<i', 0) # source positions
+    data += struct.pack(f'<i{len(code)}h', len(code), *code) + b'\0' * (len(code) % 2 * 2)
+    data += struct.pack('<i', len(slots)) + b''.join(struct.pack('<hH', *slot) for slot in slots)
+    data += struct.pack('<2i', 0, 0) # super class getters, properties
+    return data
+
+def build_tjs2(string_count=1000, byte_count=4096, code_sectors=4, code_size=16384, seed=0):
+    """ Returns (tjs2 bytes, strings) laid out the way tjs2manager.parse_tjs reads it.
+    The TJS2 sectors are code objects using a random part of the string constants. """
+    rnd = random.Random(seed)
+    strings = make_strings(string_count, rnd)
+    data = bytearray()
+    data += tjs2_array(byte_count, 1, rnd)
+    data += tjs2_array(byte_count // 8, 2, rnd)
+    data += tjs2_array(byte_count // 16, 4, rnd)
+    data += tjs2_array(byte_count // 32, 8, rnd)
+    data += tjs2_array(byte_count // 32, 8, rnd)
+    data += struct.pack('<I', len(strings))
+    for string in strings:
+        encoded = string.encode('utf-16le')
+        data += struct.pack('<I', len(string)) + encoded + b'\0' * (-len(encoded) % 4)
+    data += struct.pack('<I', 0) # octet constants
+
+    body = bytearray(tjs2_sector('DATA', data))
+    body += struct.pack('<I', 1)
+    body += tjs2_sector('OBJS', bytes(rnd.randrange(256) for _ in range(64)))
+    body += struct.pack('<I', code_sectors)
+    for _ in range(code_sectors):
+        body += tjs2_sector('TJS2', tjs2_code_object(rnd, string_count, code_size // 2))
+    return b'TJS2100\0' + struct.pack('<I', 12 + len(body)) + bytes(body), strings
+
+def build_bitmap(width=256, height=256, seed=0):
+    """ 32-bit pixels with flat areas and noise, like layer textures. """
+    rnd = random.Random(seed)
+    pixels = bytearray()
+    total = width * height
+    while len(pixels) < total * 4:
+        pixel = bytes(rnd.randrange(256) for _ in range(4))
+        run = rnd.choice((1, 1, 2, 5, 40, 300))
+        pixels += pixel * run
+    return bytes(pixels[:total * 4])
@@ -0,0 +1,192 @@
+""" Times the main code paths over synthetic fixtures and reports JSON. """
+import gc
+import io
+import platform
+import time
+import tracemalloc
+from .. import __version__
+from ..analyzer import PSBAnalyzer
+from ..stringmanager import PSBStrMan
+from ..resourcemanager import PSBResManager, HuffmanTool
+from ..tjs2manager import TJS2SManager
+from . import fixtures
+
+TIERS = {
+    'small': {'strings': 1000, 'resources': 8, 'resource_size': 4096, 'bitmap': 64, 'tjs_strings': 1000},
+    'medium': {'strings': 20000, 'resources': 64, 'resource_size': 16384, 'bitmap': 256, 'tjs_strings': 10000},
+    'large': {'strings': 100000, 'resources': 256, 'resource_size': 65536, 'bitmap': 512, 'tjs_strings': 50000},
+}
+
+class Case:
+    """ A benchmark: `setup(tier)` builds the state once, `run(state)` is timed
+    and returns (bytes processed, strings processed). """
+    def __init__(self, name, setup, run):
+        self.name = name
+        self.setup = setup
+        self.run = run
+
+def setup_psb(tier):
+    psb, strings, _ = fixtures.build_psb(tier['strings'], seed=1)
+    return {'psb': psb, 'strings': strings}
+
+def setup_mdf(tier):
+    state = setup_psb(tier)
+    state['mdf'] = fixtures.build_mdf(state['psb'])
+    return state
+
+def setup_analyzer_export(tier):
+    state = setup_psb(tier)
+    analyzer = PSBAnalyzer(state['psb'])
+    state['analyzer'] = analyzer
+    state['imported'] = analyzer.import_strings()
+    return state
+
+def setup_strman_export(tier):
+    state = setup_psb(tier)
+    manager = PSBStrMan(state['psb'])
+    state['manager'] = manager
+    state['imported'] = manager.import_strings()
+    return state
+
+def setup_resources(tier):
+    psb, strings, resources = fixtures.build_psb(tier['strings'] // 10, seed=2,
+        resource_count=tier['resources'], resource_size=tier['resource_size'])
+    return {'psb': psb, 'resources': resources}
+
+def setup_resources_export(tier):
+    state = setup_resources(tier)
+    manager = PSBResManager()
+    state['entries'] = manager.Import(state['psb'])
+    state['manager'] = manager
+    return state
+
+def setup_bitmap(tier):
+    size = tier['bitmap']
+    bitmap = fixtures.build_bitmap(size, size, seed=3)
+    return {'bitmap': bitmap, 'compressed': bytes(HuffmanTool.CompressBitmap(bitmap, False))}
+
+def setup_tjs2(tier):
+    tjs2, strings = fixtures.build_tjs2(tier['tjs_strings'], seed=4)
+    return {'tjs2': tjs2, 'strings': strings}
+
+def setup_tjs2_export(tier):
+    state = setup_tjs2(tier)
+    manager = TJS2SManager(io.BytesIO(state['tjs2']))
+    state['manager'] = manager
+    state['imported'] = manager.import_strings()
+    return state
+
+def run_analyzer_import(state):
+    strings = PSBAnalyzer(state['psb']).import_strings()
+    return len(state['psb']), len(strings)
+
+def run_analyzer_mdf_import(state):
+    strings = PSBAnalyzer(state['mdf']).import_strings()
+    return len(state['psb']), len(strings)
+
+def run_analyzer_export(state):
+    data = state['analyzer'].export_strings(state['imported'])
+    return len(data), len(state['imported'])
+
+def run_strman_import(state):
+    strings = PSBStrMan(state['psb']).import_strings()
+    return len(state['psb']), len(strings)
+
+def run_strman_export(state):
+    data = state['manager'].export_strings(state['imported'])
+    return len(data), len(state['imported'])
+
+def run_resources_import(state):
+    entries = PSBResManager().Import(state['psb'])
+    return sum(len(entry.Data) for entry in entries), 0
+
+def run_resources_export(state):
+    data = state['manager'].Export(state['entries'])
+    return len(data), 0
+
+def run_bitmap_compress(state):
+    HuffmanTool.CompressBitmap(state['bitmap'], False)
+    return len(state['bitmap']), 0
+
+def run_bitmap_decompress(state):
+    HuffmanTool.DecompressBitmap(state['compressed'])
+    return len(state['bitmap']), 0
+
+def run_tjs2_import(state):
+    strings = TJS2SManager(io.BytesIO(state['tjs2'])).import_strings()
+    return len(state['tjs2']), len(strings)
+
+def run_tjs2_references(state):
+    references = TJS2SManager(io.BytesIO(state['tjs2'])).build_references()
+    return len(state['tjs2']), len(references)
+
+def run_tjs2_export(state):
+    data = state['manager'].export_strings(state['imported'])
+    return len(data), len(state['imported'])
+
+CASES = [
+    Case('analyzer_import', setup_psb, run_analyzer_import),
+    Case('analyzer_mdf_import', setup_mdf, run_analyzer_mdf_import),
+    Case('analyzer_export', setup_analyzer_export, run_analyzer_export),
+    Case('strman_import', setup_psb, run_strman_import),
+    Case('strman_export', setup_strman_export, run_strman_export),
+    Case('resources_import', setup_resources, run_resources_import),
+    Case('resources_export', setup_resources_export, run_resources_export),
+    Case('bitmap_compress', setup_bitmap, run_bitmap_compress),
+    Case('bitmap_decompress', setup_bitmap, run_bitmap_decompress),
+    Case('tjs2_import', setup_tjs2, run_tjs2_import),
+    Case('tjs2_export', setup_tjs2_export, run_tjs2_export),
+    Case('tjs2_references', setup_tjs2, run_tjs2_references),
+]
+
+def measure(case, tier_name, repeat=3):
+    """ Best-of-`repeat` wall time plus a separate traced run for peak memory. """
+    result = {'case': case.name, 'tier': tier_name}
+    try:
+        state = case.setup(TIERS[tier_name])
+        timings = []
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            processed, strings = case.run(state)
+            timings.append(time.perf_counter() - start)
+
+        gc.collect()
+        tracemalloc.start()
+        case.run(state)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    except Exception as e:
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+        result['error'] = f"{type(e).__name__}: {e}"
+        return result
+
+    seconds = min(timings)
+    result.update({
+        'seconds': seconds,
+        'bytes': processed,
+        'strings': strings,
+        'mb_per_s': processed / seconds / 1e6 if seconds else None,
+        'strings_per_s': strings / seconds if seconds and strings else None,
+        'peak_memory': peak,
+    })
+    return result
+
+def run_benchmarks(tiers=('small',), cases=None, repeat=3, report=None):
+    """ Runs the selected cases (all by default) over the size tiers. """
+    selected = [case for case in CASES if cases is None or case.name in cases]
+    results = []
+    for tier_name in tiers:
+        for case in selected:
+            result = measure(case, tier_name, repeat)
+            results.append(result)
+            if report:
+                report(result)
+    return {
+        'version': __version__,
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'results': results,
+    }
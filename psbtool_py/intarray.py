@@ -0,0 +1,102 @@
+import sys
+from array import array
+from .psbtype import PSBType
+
+# array typecodes by element byte width, for the widths that have a native one
+NATIVE_TYPECODES = {}
+for _typecode in 'BHIQ':
+    NATIVE_TYPECODES.setdefault(array(_typecode).itemsize, _typecode)
+
+BIG_ENDIAN_HOST = sys.byteorder == 'big'
+
+def min_int_len(value):
+    """ Minimal byte count to store `value` (0 for 0, like `get_min_int_len`). """
+    return (value.bit_length() + 7) // 8
+
+def max_value(width):
+    return (1 << (width * 8)) - 1
+
+def convert_size(tag):
+    size = tag - PSBType.INTEGER_ARRAY_N
+    if not 0 <= size <= 8:
+        raise ValueError(f"{tag} is not an INTEGER_ARRAY_N")
+    return size
+
+def unconvert_size(size):
+    if size < 9:
+        return PSBType.INTEGER_ARRAY_N + size
+    raise ValueError("Arrays can have maximum 8 byte size")
+
+def decode_uint_array(data, pos, count, width):
+    """ Decodes `count` little-endian `width`-byte integers at `pos` into array('Q'). """
+    if width == 0 or count == 0:
+        return array('Q', bytes(8 * count))
+    end = pos + count * width
+    raw = data[pos:end]
+    if len(raw) != count * width:
+        raise ValueError(f"Integer array at {pos} is truncated")
+
+    typecode = NATIVE_TYPECODES.get(width)
+    if typecode is None:
+        # spread the elements into 8 byte lanes with strided slice copies
+        wide = bytearray(8 * count)
+        for byte in range(width):
+            wide[byte::8] = raw[byte::width]
+        raw = wide
+        typecode = NATIVE_TYPECODES[8]
+    values = array(typecode)
+    values.frombytes(raw)
+    if BIG_ENDIAN_HOST:
+        values.byteswap()
+    return values if typecode == 'Q' else array('Q', values)
+
+def encode_uint_array(values, width):
+    """ Encodes integers as little-endian `width`-byte elements. """
+    if not isinstance(values, array) or values.typecode != 'Q':
+        values = array('Q', values)
+    if len(values) and max(values) > max_value(width):
+        raise ValueError(f"Value {max(values)} is too big for its byte size 2^({width} * 8)")
+
+    typecode = NATIVE_TYPECODES.get(width)
+    if typecode is not None and typecode != 'Q':
+        values = array(typecode, values)
+    elif typecode is None:
+        typecode = 'Q'
+    if BIG_ENDIAN_HOST:
+        values = array(typecode, values)
+        values.byteswap()
+    raw = values.tobytes()
+    if width == values.itemsize:
+        return raw
+
+    # gather the low `width` bytes of every 8 byte lane
+    narrow = bytearray(width * len(values))
+    for byte in range(width):
+        narrow[byte::width] = raw[byte::8]
+    return bytes(narrow)
+
+def read_array_header(data, pos):
+    """ Returns (count, element width, data position) of the INTEGER_ARRAY_N at `pos`. """
+    count_length = convert_size(data[pos])
+    count = int.from_bytes(data[pos + 1:pos + 1 + count_length], 'little')
+    pos += 1 + count_length
+    return count, convert_size(data[pos]), pos + 1
+
+def read_int_array(data, pos):
+    """ Returns (values, element width, end position) of the INTEGER_ARRAY_N at `pos`. """
+    count, width, pos = read_array_header(data, pos)
+    values = decode_uint_array(data, pos, count, width)
+    return values, width, pos + count * width
+
+def build_int_array(values, width=None, count_width=None):
+    """ Serializes an INTEGER_ARRAY_N, picking minimal widths unless given. """
+    if width is None:
+        width = min_int_len(max(values)) if len(values) else 0
+    if count_width is None:
+        count_width = min_int_len(len(values))
+    data = bytearray()
+    data.append(unconvert_size(count_width))
+    data.extend(len(values).to_bytes(count_width, 'little'))
+    data.append(unconvert_size(width))
+    data.extend(encode_uint_array(values, width))
+    return data
@@ -0,0 +1,152 @@
+""" Header-only inventory of PSB and MDF packages. """
+import mmap
+import os
+import struct
+from .algorithms import PSBHeader, PSB_HEADER_FORMAT, iter_decompress
+from .batch import run_batch, memory_estimate
+from .psbtype import PSB_MDF_SIGNATURE, PSB_SIGNATURE
+from . import intarray
+from . import mdf
+
+PSB_HEADER_SIZE = struct.calcsize(PSB_HEADER_FORMAT)
+# type byte, count of up to 8 bytes, element type byte
+ARRAY_PREAMBLE_SIZE = 10
+
+# pack peaks at 9-10 times the PSB size on string heavy packages, unpack at
+# about 6; packages made mostly of resources need much less
+PACKAGE_MEMORY_FACTOR = 10
+
+COLUMNS = [
+    ('path', 'Path'),
+    ('container', 'Type'),
+    ('file_size', 'Size'),
+    ('psb_size', 'PSB size'),
+    ('version', 'Ver'),
+    ('string_count', 'Strings'),
+    ('string_offset_width', 'Str width'),
+    ('resource_count', 'Resources'),
+    ('resource_offset_width', 'Res width'),
+]
+
+class InflatedWindow:
+    """ Forward reads of the PSB inside a MDF package.
+
+    Inflates only up to the bytes asked for and keeps just the blocks from
+    the last read position on, so memory stays around one block whatever
+    the offsets. Reading backwards starts the inflate over.
+    """
+    def __init__(self, package, chunk_size=1 << 16):
+        self.package = package
+        self.chunk_size = chunk_size
+        self.restart()
+
+    def restart(self):
+        self.blocks = iter_decompress(mdf.mdf_payload(self.package), self.chunk_size)
+        self.base = 0 # PSB offset of data[0]
+        self.data = bytearray()
+        self.inflated = 0
+
+    def drop_before(self, pos):
+        drop = min(pos - self.base, len(self.data))
+        if drop > 0:
+            del self.data[:drop]
+            self.base += drop
+
+    def read(self, pos, length):
+        if pos < self.base:
+            self.restart()
+        self.drop_before(pos)
+        while self.base + len(self.data) < pos + length:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            self.inflated += len(block)
+            self.data += block
+            self.drop_before(pos)
+        start = pos - self.base
+        return bytes(self.data[start:start + length])
+
+def stat_package(data, resources=False):
+    """ Reads the header, the string and resource table preambles and, for
+    MDF, the stored size of a package; returns them as a dict.
+
+    The resource tables follow the bytecode and strings, so for MDF they are
+    only read with `resources` (it inflates most of the package).
+    """
+    view = memoryview(data).cast('B')
+    info = {'file_size': len(view)}
+    window = None
+    if view[:4] == PSB_MDF_SIGNATURE:
+        info['container'] = 'mdf'
+        info['psb_size'] = mdf.read_mdf_size(view)
+        window = InflatedWindow(view)
+        read = window.read
+    elif view[:4] == PSB_SIGNATURE:
+        info['container'] = 'psb'
+        info['psb_size'] = len(view)
+        read = lambda pos, length: view[pos:pos + length]
+        resources = True
+    else:
+        raise Exception("Invalid Package")
+
+    head = bytes(read(0, PSB_HEADER_SIZE))
+    if len(head) < PSB_HEADER_SIZE or head[:4] != PSB_SIGNATURE:
+        raise Exception("Package does not contain a PSB")
+    header = PSBHeader.from_bytes(head)
+
+    def preamble(pos):
+        if not pos:
+            return 0, 0
+        count, width, _ = intarray.read_array_header(read(pos, ARRAY_PREAMBLE_SIZE), 0)
+        return count, width
+
+    info['version'] = header.version
+    info['string_count'], info['string_offset_width'] = preamble(header.str_off_pos)
+    if resources:
+        # in file order, so the window only moves forward
+        info['resource_count'], info['resource_offset_width'] = preamble(header.res_off_pos)
+        info['resource_size_width'] = preamble(header.res_data_pos)[1]
+    info['bytecode_pos'] = header.res_index_tree
+    info['resource_data_pos'] = header.res_len_pos
+    if window is not None:
+        info['inflated'] = window.inflated
+    return info
+
+def stat_file(path, resources=False):
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return dict({'path': path}, **stat_package(mapped, resources))
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            pass # a traceback still holds a view, the mapping closes with it
+
+def psb_size(path):
+    """ Size of the PSB in a package, read from the MDF header or taken from the file size. """
+    with open(path, 'rb') as f:
+        head = f.read(mdf.MDF_HEADER_SIZE)
+    if len(head) == mdf.MDF_HEADER_SIZE and head[:4] == PSB_MDF_SIGNATURE:
+        return mdf.read_mdf_size(head)
+    return os.path.getsize(path)
+
+def package_memory(path, factor=PACKAGE_MEMORY_FACTOR):
+    """ Estimated peak memory of unpacking or packing a package, scaled by its PSB size. """
+    return memory_estimate(path, factor, psb_size)
+
+def scan_files(files, jobs=1, resources=False):
+    """ Inventory of many packages; failed files get an 'error' entry instead. """
+    return [result.value if result.ok else {'path': result.path, 'error': result.error.strip().splitlines()[-1]}
+        for result in run_batch(stat_file, files, (resources,), jobs, report=None)]
+
+def format_table(rows):
+    """ Plain text table of `scan_files` results, failures listed last. """
+    ok = [row for row in rows if 'error' not in row]
+    cells = [[title for _, title in COLUMNS]]
+    cells += [[str(row.get(key, '')) for key, _ in COLUMNS] for row in ok]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(COLUMNS))]
+    lines = ['  '.join(cell.ljust(width) if i == 0 else cell.rjust(width)
+        for i, (cell, width) in enumerate(zip(line, widths))) for line in cells]
+    lines += [f"{row['path']}: FAILED {row['error']}" for row in rows if 'error' in row]
+    return '\n'.join(lines)
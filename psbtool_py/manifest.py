@@ -0,0 +1,75 @@
+import hashlib
+import json
+import os
+from . import __version__
+
+# one manifest per tool, so tools sharing an output folder don't reset each other
+MANIFEST_NAME = '.psbtool_manifest.{tool}.json'
+
+def file_hash(path, chunk_size=1 << 20):
+    """ Content hash of a file, None if it doesn't exist. """
+    if not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(chunk_size)
+    return digest.hexdigest()
+
+class PackManifest:
+    """ Records the source and translation hashes each output in `out_dir` was built from.
+
+    Each tool keeps its own manifest file; its entries are dropped as a whole
+    when the version or the export options change.
+    """
+    def __init__(self, out_dir, tool, options=None):
+        self.path = os.path.join(out_dir, MANIFEST_NAME.format(tool=tool))
+        self.tool = tool
+        self.options = dict(options or {})
+        self.entries = {}
+        self.load()
+
+    @staticmethod
+    def key(source):
+        return os.path.abspath(source)
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (data.get('tool') == self.tool and data.get('version') == __version__
+                and data.get('options') == self.options):
+            self.entries = data.get('entries', {})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        data = {
+            'tool': self.tool,
+            'version': __version__,
+            'options': self.options,
+            'entries': self.entries,
+        }
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(temp_path, self.path)
+
+    @staticmethod
+    def input_hashes(source, translation):
+        return {'source': file_hash(source), 'translation': file_hash(translation)}
+
+    def is_current(self, source, hashes, output):
+        entry = self.entries.get(self.key(source))
+        return (entry is not None and hashes['translation'] is not None
+                and entry.get('inputs') == hashes and entry.get('output') == os.path.abspath(output)
+                and os.path.isfile(output))
+
+    def update(self, source, hashes, output):
+        self.entries[self.key(source)] = {'inputs': hashes, 'output': os.path.abspath(output)}
+
+    def remove(self, source):
+        self.entries.pop(self.key(source), None)
@@ -0,0 +1,70 @@
+import struct
+from .psbtype import PSB_MDF_SIGNATURE, PSB_SIGNATURE
+from .algorithms import CHUNK_SIZE, compress_segments, decompress_into, iter_decompress, write_segments
+from .profiling import phase
+
+# MDF container: signature, uncompressed size (uint32 LE), zlib stream
+MDF_HEADER_FORMAT = '<4sI'
+MDF_HEADER_SIZE = struct.calcsize(MDF_HEADER_FORMAT)
+
+def read_mdf_size(data):
+    signature, size = struct.unpack_from(MDF_HEADER_FORMAT, data, 0)
+    if signature != PSB_MDF_SIGNATURE:
+        raise Exception("Not a MDF package")
+    return size
+
+def mdf_payload(data):
+    return memoryview(data).cast('B')[MDF_HEADER_SIZE:]
+
+def peek_mdf(data, length=len(PSB_SIGNATURE)):
+    """ Inflates only the first chunk of a MDF package and returns its first `length` bytes. """
+    read_mdf_size(data)
+    head = bytearray()
+    for block in iter_decompress(mdf_payload(data), max(length, 64)):
+        head += block
+        if len(head) >= length:
+            break
+    return bytes(head[:length])
+
+def is_mdf_psb(data):
+    """ Fast check that a MDF package wraps a PSB, without inflating all of it. """
+    try:
+        return peek_mdf(data) == PSB_SIGNATURE
+    except Exception:
+        return False
+
+def extract_mdf(data, out=None, chunk_size=CHUNK_SIZE):
+    """ Inflates a MDF package into a buffer preallocated from the stored size.
+
+    `out` may be a caller provided writable buffer of at least that size.
+    """
+    size = read_mdf_size(data)
+    if out is None:
+        out = bytearray(size)
+    view = memoryview(out).cast('B')
+    if len(view) < size:
+        raise ValueError(f"Output buffer is smaller than the {size} bytes MDF content")
+
+    # bail out after the first chunk instead of inflating a foreign file
+    if peek_mdf(data) != PSB_SIGNATURE:
+        raise Exception("MDF package does not contain a PSB")
+    with phase('mdf.extract', size):
+        try:
+            _, pos = decompress_into(mdf_payload(data), view[:size], 0, chunk_size)
+        except ValueError:
+            raise Exception(f"MDF content is bigger than its declared size {size}")
+    if pos != size:
+        raise Exception(f"MDF content size {pos} doesn't match its declared size {size}")
+    return out
+
+def build_mdf_header(size):
+    return struct.pack(MDF_HEADER_FORMAT, PSB_MDF_SIGNATURE, size)
+
+def compress_mdf(psb, compression=9):
+    return build_mdf_header(len(psb)) + compress_segments([psb], compression)
+
+def write_mdf(segments, output, compression=9):
+    """ Writes buffers as a MDF package in one pass; returns the bytes written. """
+    size = sum(len(memoryview(segment).cast('B')) for segment in segments)
+    written = write_segments(output, [build_mdf_header(size)])
+    return written + compress_segments(segments, compression, output)
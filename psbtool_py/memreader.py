@@ -1,14 +1,52 @@
+import mmap
 import struct
+from itertools import accumulate
 
 class MemoryReader:
+    """ Position based reader over any buffer (bytes, bytearray, mmap, memoryview).
+
+    Reads hand out memoryview slices of the underlying buffer instead of copies.
+    """
     def __init__(self, data):
         self.data = data
+        self.view = memoryview(data).cast('B')
         self.position = 0
+        self.owned = None
+        # native find of the buffer, when its offsets match the view's
+        source = data.obj if isinstance(data, memoryview) else data
+        self.finder = getattr(source, 'find', None)
+        if self.finder is not None:
+            with memoryview(source) as whole:
+                if whole.nbytes != self.view.nbytes:
+                    self.finder = None
+
+    @classmethod
+    def from_file(cls, path):
+        """ Maps the file read-only; the mapping is closed when the reader exits. """
+        with open(path, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        reader = cls(mapped)
+        reader.owned = mapped
+        return reader
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def __len__(self):
+        return len(self.view)
+
+    def close(self):
+        self.view.release()
+        if self.owned is not None:
+            try:
+                self.owned.close()
+            except BufferError:
+                pass # views handed out are still alive, the mapping closes with them
+            self.owned = None
+        self.finder = None
         del self.data
 
     def seek(self, position, mode=0):
@@ -17,26 +55,89 @@ class MemoryReader:
         elif mode == 1:
             self.position += position
         elif mode == 2:
-            self.position = len(self.data) - position
+            self.position = len(self.view) - position
+
+    def tell(self):
+        return self.position
 
     def read_byte(self):
-        value = self.data[self.position]
+        value = self.view[self.position]
         self.position += 1
         return value
 
     def read_bytes(self, length):
-        value = self.data[self.position:self.position+length]
+        value = self.view[self.position:self.position+length]
         self.position += length
         return value
 
     def read_uint32(self):
-        value = struct.unpack("<I", self.data[self.position:self.position+4])[0]
+        value = struct.unpack_from("<I", self.view, self.position)[0]
         self.position += 4
         return value
 
-    def read_cstring(self):
-        base_pos = self.position
-        while self.data[self.position] != 0 and self.position < len(self.data):
-            self.position += 1
-        self.position += 1
-        return bytearray(self.data[base_pos:self.position-1]).decode("utf-8", "unicodeescape")
\ No newline at end of file
+    def read_struct(self, fmt):
+        values = struct.unpack_from(fmt, self.view, self.position)
+        self.position += struct.calcsize(fmt)
+        return values
+
+    def find(self, sub, start=0, end=None):
+        if end is None:
+            end = len(self.view)
+        finder = self.finder
+        if finder is not None:
+            return finder(sub, start, end)
+        # a memoryview over part of a buffer: copy growing windows, not the whole rest
+        window = 256
+        while start < end:
+            stop = min(end, start + window)
+            found = bytes(self.view[start:stop]).find(sub)
+            if found >= 0:
+                return start + found
+            if stop == end:
+                break
+            start = stop - len(sub) + 1
+            window *= 2
+        return -1
+
+    def cstring_end(self, position):
+        end = self.find(b'\0', position)
+        return len(self.view) if end < 0 else end
+
+    def read_cstring(self, encoding="utf-8", errors="unicodeescape"):
+        end = self.cstring_end(self.position)
+        value = str(self.view[self.position:end], encoding, errors)
+        self.position = end + 1
+        return value
+
+    def read_cstrings(self, base, offsets, encoding="utf-8", errors="unicodeescape"):
+        """ Decodes the NUL terminated strings at `base + offset` for every offset.
+
+        The whole region is decoded at once and split on the terminators;
+        offsets that do not start a string (shared suffixes) fall back to a
+        single-string decode. Leaves the position after the end of the region,
+        i.e. past the string at the highest offset.
+        """
+        if not len(offsets):
+            return []
+        end = self.cstring_end(base + max(offsets))
+        try:
+            parts = str(self.view[base:end], encoding, errors).split('\0')
+        except (UnicodeDecodeError, LookupError):
+            parts = None
+
+        strings = [None] * len(offsets)
+        if parts is not None:
+            # byte offsets of the sequential strings; the strict decode above
+            # round trips, so the encoded length of a part is its raw length
+            starts = accumulate(((len(part) if part.isascii() else len(part.encode(encoding))) + 1
+                for part in parts), initial=0)
+            by_start = dict(zip(starts, parts))
+            strings = [by_start.get(offset) for offset in offsets]
+
+        for i, string in enumerate(strings):
+            if string is None:
+                start = base + offsets[i]
+                strings[i] = str(self.view[start:self.cstring_end(start)], encoding, errors)
+
+        self.position = end + 1
+        return strings
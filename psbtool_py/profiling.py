@@ -0,0 +1,157 @@
+""" Optional per-phase instrumentation.
+
+Library code wraps its phases in `with phase(name, nbytes, strings):`. With no
+active profiler that is a shared no-op context manager, so the hooks cost a
+global lookup and a call. `PhaseProfiler` records wall time, bytes, string
+counts and (optionally) the allocation peak of each phase.
+"""
+import json
+import sys
+import time
+import tracemalloc
+
+_profiler = None
+
+class NullPhase:
+    """ Phase of a disabled profiler: counts assigned to it are dropped. """
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+NULL_PHASE = NullPhase()
+
+def phase(name, nbytes=0, strings=0):
+    """ Times a phase on the active profiler, if any. """
+    if _profiler is None:
+        return NULL_PHASE
+    return _profiler.phase(name, nbytes, strings)
+
+def count(name, nbytes=0, strings=0):
+    """ Adds bytes or strings to a phase without timing it. """
+    if _profiler is not None:
+        _profiler.add(name, 0.0, nbytes, strings, calls=0)
+
+def set_profiler(profiler):
+    """ Makes `profiler` (or None) the active one; returns the previous one. """
+    global _profiler
+    previous = _profiler
+    _profiler = profiler
+    return previous
+
+def get_profiler():
+    return _profiler
+
+class Phase:
+    def __init__(self, profiler, name, nbytes, strings):
+        self.profiler = profiler
+        self.name = name
+        self.nbytes = nbytes
+        self.strings = strings
+        self.start_memory = 0
+        self.peak_memory = 0
+
+    def __enter__(self):
+        profiler = self.profiler
+        if profiler.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            # the outer phases keep the peak reached so far before it is reset
+            for outer in profiler.stack:
+                outer.peak_memory = max(outer.peak_memory, peak)
+            tracemalloc.reset_peak()
+            self.start_memory = self.peak_memory = current
+        profiler.stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        seconds = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.stack.pop()
+        peak = None
+        if profiler.trace_memory:
+            self.peak_memory = max(self.peak_memory, tracemalloc.get_traced_memory()[1])
+            peak = self.peak_memory - self.start_memory
+            for outer in profiler.stack:
+                outer.peak_memory = max(outer.peak_memory, self.peak_memory)
+        profiler.add(self.name, seconds, self.nbytes, self.strings, peak)
+        return False
+
+class PhaseProfiler:
+    """ Per-phase totals: calls, seconds, bytes, strings and the largest
+    allocation growth seen inside the phase when `trace_memory` is set. """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.phases = {}
+        self.stack = []
+        self.started_tracing = False
+
+    def __enter__(self):
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        self.previous = set_profiler(self)
+        return self
+
+    def __exit__(self, *args):
+        set_profiler(self.previous)
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+        return False
+
+    def phase(self, name, nbytes=0, strings=0):
+        return Phase(self, name, nbytes, strings)
+
+    def add(self, name, seconds, nbytes=0, strings=0, peak_memory=None, calls=1):
+        entry = self.phases.get(name)
+        if entry is None:
+            entry = self.phases[name] = {'calls': 0, 'seconds': 0.0, 'bytes': 0, 'strings': 0, 'peak_memory': None}
+        entry['calls'] += calls
+        entry['seconds'] += seconds
+        entry['bytes'] += nbytes
+        entry['strings'] += strings
+        if peak_memory is not None:
+            entry['peak_memory'] = max(entry['peak_memory'] or 0, peak_memory)
+
+    def to_dict(self):
+        return {name: dict(entry) for name, entry in self.phases.items()}
+
+def merge_profiles(profiles):
+    """ Sums per-phase dicts of several files; peaks are the largest seen. """
+    total = PhaseProfiler()
+    for profile in profiles:
+        for name, entry in profile.items():
+            total.add(name, entry['seconds'], entry['bytes'], entry['strings'],
+                entry['peak_memory'], entry['calls'])
+    return total.to_dict()
+
+def build_report(results):
+    """ Profiling report of batch results run with profiling on. """
+    files = {result.path: result.profile for result in results if result.profile}
+    return {'total': merge_profiles(files.values()), 'files': files}
+
+def format_report(report):
+    lines = [f"{'Phase':<24} {'Calls':>7} {'Seconds':>10} {'MB':>10} {'Strings':>10} {'Peak MB':>9}"]
+    phases = sorted(report['total'].items(), key=lambda item: item[1]['seconds'], reverse=True)
+    for name, entry in phases:
+        peak = f"{entry['peak_memory'] / 1e6:9.2f}" if entry['peak_memory'] is not None else ' ' * 9
+        lines.append(f"{name:<24} {entry['calls']:>7} {entry['seconds']:>10.4f}"
+            f" {entry['bytes'] / 1e6:>10.2f} {entry['strings']:>10} {peak}")
+    return '\n'.join(lines)
+
+def report_profile(results, json_path=None):
+    """ Prints the report of profiled batch results to stderr and, with
+    `json_path`, also saves it there as JSON. """
+    report = build_report(results)
+    print(format_report(report), file=sys.stderr)
+    if json_path:
+        with open(json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=1, ensure_ascii=False)
+    return report
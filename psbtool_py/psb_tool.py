@@ -1,6 +1,10 @@
 from psbtool_py.analyzer import PSBAnalyzer
+from psbtool_py.batch import run_batch, run_incremental_batch, exit_status
+from psbtool_py.manifest import PackManifest
+from psbtool_py.inventory import scan_files, format_table, package_memory, PACKAGE_MEMORY_FACTOR
+from psbtool_py.profiling import phase, report_profile
 from glob import glob
-import os, sys
+import json, os, sys
 from filetranslate.service_fn import read_csv_list, write_csv_list
 
 SCN_PATHS = "scn\\*.scn"
@@ -8,6 +12,7 @@ STRINGS_NAME = "strings"
 ATTRIBUTES_NAME = "attributes"
 STRINGS_DB_POSTFIX = "_" + STRINGS_NAME + ".csv"
 DEF_OUT_DIR = 'translation_out'
+EXPORT_OPTIONS = {'compress_package': False, 'compression_level': 9, 'extend_string_limit': False, 'share_strings': False}
 
 def make_postfixed_name(name, postfix):
     return os.path.join(os.path.dirname(name), os.path.basename(name) + postfix)
@@ -16,76 +21,114 @@ def remove_ext(name):
     name = name.split('.')
     return '.'.join(name[:-1])
 
+def translations_name(name, ext=''):
+    return make_postfixed_name(remove_ext(name), ext + STRINGS_DB_POSTFIX)
+
 def read_string_translations(name, ext=''):
-    name = remove_ext(name)
-    name = make_postfixed_name(name, ext + STRINGS_DB_POSTFIX)
-    return read_csv_list(name)
+    with phase('csv.read'):
+        return read_csv_list(translations_name(name, ext))
 
-def pack_function(scenarios, out_dir):
-    cwd = os.getcwd()
-    for fn in glob(scenarios):
-        fncsv = read_string_translations(fn)
-        if not fncsv: continue
-        ofn = os.path.abspath(os.path.abspath(fn).replace(os.getcwd(), out_dir))
-        if out_dir != DEF_OUT_DIR:
-            print(f"Translating to {ofn} ... ")
-        else:
-            print(f"Translating {fn.replace(cwd, '')} ... ")
-        ofn_dir = ''
-        with open(fn, 'rb') as f:
-            a = PSBAnalyzer(f.read())
-            so = a.import_strings()
-            i_empty = so.index('')
-            fncsv.insert(i_empty, ['', ''])
-            assert len(fncsv) == len(so), f"strings should have the same count as original ({len(so)})"
-            for i, s in enumerate(so):
-                if not s: continue
-                #print(fncsv[i][0], so[i])
-                if fncsv[i][0][:2] != "//":
-                    so[i] = fncsv[i][1]
-            if ofn_dir != os.path.dirname(ofn):
-                ofn_dir = os.path.dirname(ofn)
-                if ofn_dir != '' and not os.path.exists(ofn_dir):
-                    os.makedirs(ofn_dir, exist_ok=True)
-            with open(ofn, 'wb') as o:
-                o.write(a.export_strings(so))
-                pass
-        pass
+def output_name(fn, out_dir):
+    return os.path.abspath(os.path.abspath(fn).replace(os.getcwd(), out_dir))
 
-def unpack_function(scenarios):
-    cwd = os.getcwd()
-    for fn in glob(scenarios):
-        fncsv = make_postfixed_name(os.path.splitext(fn)[0], STRINGS_DB_POSTFIX)
-        if os.path.isfile(fncsv): continue
-        print(f"Parsing {fn.replace(cwd, '')} ... ", end='')
+def pack_file(fn, out_dir, options=EXPORT_OPTIONS):
+    fncsv = read_string_translations(fn)
+    if not fncsv: return None
+    ofn = output_name(fn, out_dir)
+    if os.path.exists(ofn) and os.path.samefile(fn, ofn):
+        # packing in place: a mapped source can't be replaced on every OS
         with open(fn, 'rb') as f:
-            so = []
-            s = []
             a = PSBAnalyzer(f.read())
-            so = a.import_strings()
-            for i in so:
-                if not i: continue
-                s.append([i, ''])
-            write_csv_list(fncsv, s)
-            print(f"{len(so)} strings")
-        pass
+    else:
+        a = PSBAnalyzer.from_file(fn)
+    a.compress_package = options['compress_package']
+    a.compression_level = options['compression_level']
+    a.string_manager.force_max_offset_length = options['extend_string_limit']
+    a.share_strings = options['share_strings']
+    so = a.import_strings()
+    i_empty = so.index('')
+    fncsv.insert(i_empty, ['', ''])
+    assert len(fncsv) == len(so), f"strings should have the same count as original ({len(so)})"
+    for i, s in enumerate(so):
+        if not s: continue
+        #print(fncsv[i][0], so[i])
+        if fncsv[i][0][:2] != "//":
+            so[i] = fncsv[i][1]
+    ofn_dir = os.path.dirname(ofn)
+    if ofn_dir != '' and not os.path.exists(ofn_dir):
+        os.makedirs(ofn_dir, exist_ok=True)
+    a.write_strings(so, ofn)
+    return f"translated to {ofn}" if out_dir != DEF_OUT_DIR else "translated"
+
+def unpack_file(fn):
+    fncsv = make_postfixed_name(os.path.splitext(fn)[0], STRINGS_DB_POSTFIX)
+    if os.path.isfile(fncsv): return None
+    s = []
+    a = PSBAnalyzer.from_file(fn)
+    so = a.import_strings()
+    for i in so:
+        if not i: continue
+        s.append([i, ''])
+    with phase('csv.write', strings=len(s)):
+        write_csv_list(fncsv, s)
+    return f"{len(so)} strings"
+
+def pack_function(scenarios, out_dir, jobs=1, force=False, options=None, profile=False, memory_budget=None,
+        memory_factor=PACKAGE_MEMORY_FACTOR):
+    options = dict(EXPORT_OPTIONS, **(options or {}))
+    manifest = PackManifest(out_dir, 'psb_tool', options)
+    inputs_of = lambda fn: (translations_name(fn), output_name(fn, out_dir))
+    return run_incremental_batch(pack_file, glob(scenarios), manifest, inputs_of, (out_dir, options), jobs, force,
+        profile=profile, memory_budget=memory_budget, memory_of=lambda fn: package_memory(fn, memory_factor))
+
+def unpack_function(scenarios, jobs=1, profile=False, memory_budget=None, memory_factor=PACKAGE_MEMORY_FACTOR):
+    return run_batch(unpack_file, glob(scenarios), (), jobs, profile=profile,
+        memory_budget=memory_budget, memory_of=lambda fn: package_memory(fn, memory_factor))
+
+def stat_function(scenarios, jobs=1, as_json=False, resources=False):
+    rows = scan_files(glob(scenarios), jobs, resources)
+    if as_json:
+        print(json.dumps(rows, indent=1, ensure_ascii=False))
+    else:
+        print(format_table(rows))
+    return rows
 
 def main():
     if len(sys.argv) > 1:
         import argparse
 
         parser = argparse.ArgumentParser(description='Tool to pack and unpack KiriKiri .scn strings')
-        parser.add_argument('command', choices=['pack', 'unpack'], help='Command to run')
+        parser.add_argument('command', choices=['pack', 'unpack', 'stat', 'scan'], help='Command to run (scan is an alias of stat)')
         parser.add_argument('path', nargs='?', default=SCN_PATHS, help='Files mask')
         parser.add_argument('-od', default=DEF_OUT_DIR, help='Files mask')
+        parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 = one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Rebuild even unchanged files')
+        parser.add_argument('--share-strings', action='store_true', help='Store identical strings and shared suffixes once')
+        parser.add_argument('--json', action='store_true', help='Print stat results as JSON')
+        parser.add_argument('--resources', action='store_true', help='Stat also reads the resource tables of MDF packages (inflates most of them)')
+        parser.add_argument('--profile', nargs='?', const='', default=None, metavar='JSON',
+            help='Print per-phase time, bytes, strings and memory peaks; optionally save them as JSON')
+        parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+            help='Start files only while their estimated memory use fits in this budget')
+        parser.add_argument('--memory-factor', type=float, default=PACKAGE_MEMORY_FACTOR,
+            help='Estimated memory use of a file per byte of PSB (default %(default)s)')
         args = parser.parse_args()
+        profile = args.profile is not None
+        budget = int(args.memory_budget * 1e6) if args.memory_budget else None
 
         if args.command == 'pack':
-            pack_function(args.path, args.od)
+            results = pack_function(args.path, args.od, args.jobs, args.force, {'share_strings': args.share_strings}, profile, budget,
+                args.memory_factor)
         elif args.command == 'unpack':
-            unpack_function(args.path)
+            results = unpack_function(args.path, args.jobs, profile, budget, args.memory_factor)
+        else:
+            rows = stat_function(args.path, args.jobs, args.json, args.resources)
+            return 0 if all('error' not in row for row in rows) else 1
+        if profile:
+            report_profile(results, args.profile)
     else:
-        pack_function(SCN_PATHS, DEF_OUT_DIR)
+        results = pack_function(SCN_PATHS, DEF_OUT_DIR)
+    return exit_status(results)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file
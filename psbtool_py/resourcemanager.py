@@ -1,9 +1,24 @@
-import zlib
+import hashlib
+import io
+import mmap
+import os
+from collections import Counter
+from contextlib import ExitStack
+from itertools import groupby
+from tempfile import SpooledTemporaryFile
 from .stringmanager import PSBStrMan
+from .psbtype import PackageStatus
+from . import intarray
+from .algorithms import CHUNK_SIZE, compress_segments, is_path, iter_chunks, write_segments, write_via_temp
+from . import mdf
+from .profiling import phase
 
 class PSBResManager:
     def __init__(self):
         self.packget = None
+        self.view = None
+        self.Offsets = []
+        self.Sizes = []
         self.EntryCount = 0
         self.ResSizePos = 0
         self.Initialized = False
@@ -16,75 +31,200 @@ class PSBResManager:
         self.CompressPackget = False
         self.CompressionLevel = 9
         self.FixOffsets = True
+        self.DedupResources = False # store identical resources once
+        self.SavedBytes = 0
 
     def Import(self, script):
-        Status = PSBStrMan.GetPackgetStatus(script)
-        if Status == PSBStrMan.PackgetStatus.MDF:
-            script = PSBStrMan.ExtractMDF(script)
-        Status = PSBStrMan.GetPackgetStatus(script)
-        if Status != PSBStrMan.PackgetStatus.PSB:
+        """ Reads the resource tables; entries hold memoryview slices of the package, not copies. """
+        Status = PSBStrMan.get_package_status(script)
+        if Status == PackageStatus.MDF:
+            script = PSBStrMan.extract_mdf(script)
+        elif Status != PackageStatus.PSB:
             raise Exception("Bad File Format")
 
-        self.packget = script
-        self.StartPos = PSBStrMan.ReadOffset(self.packget, 0x20, 4)
-        self.OffsetPos = PSBStrMan.ReadOffset(self.packget, 0x18, 4)
-        tmp = self.GetOffsetInfo(self.packget, self.OffsetPos)
-        self.OffsetSize = tmp[0]
-        self.OffsetTablePos = tmp[1]
-        self.ResSizePos = PSBStrMan.ReadOffset(self.packget, 0x1C, 4)
-        tmp = self.GetOffsetInfo(self.packget, self.ResSizePos)
-        self.ResSizeOffSize = tmp[0]
-        self.ResSizeOffTablePos = tmp[1]
-        Offsets = self.GetValues(self.packget, self.OffsetPos)
-        Sizes = self.GetValues(self.packget, self.ResSizePos)
-        self.EntryCount = len(Offsets)
-        Files = []
+        with phase('resources.tables'):
+            self.packget = script
+            self.view = memoryview(script).cast('B')
+            self.StartPos = PSBStrMan.read_offset(self.view, 0x20, 4)
+            self.OffsetPos = PSBStrMan.read_offset(self.view, 0x18, 4)
+            self.OffsetSize, self.OffsetTablePos, _ = self.GetOffsetInfo(self.view, self.OffsetPos)
+            self.ResSizePos = PSBStrMan.read_offset(self.view, 0x1C, 4)
+            self.ResSizeOffSize, self.ResSizeOffTablePos, _ = self.GetOffsetInfo(self.view, self.ResSizePos)
+            self.Offsets = self.GetValues(self.view, self.OffsetPos)
+            self.Sizes = self.GetValues(self.view, self.ResSizePos)
+            if len(self.Offsets) != len(self.Sizes):
+                raise Exception("Resource offset and size tables don't match")
+            self.EntryCount = len(self.Offsets)
+            self.Initialized = True
+        return [FileEntry(self.GetResource(i)) for i in range(self.EntryCount)]
+
+    def ImportFile(self, path):
+        """ Imports a package through a read-only mapping of the file. """
+        with open(path, 'rb') as f:
+            return self.Import(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def GetResource(self, index):
+        Start = self.StartPos + self.Offsets[index]
+        End = Start + self.Sizes[index]
+        if End > len(self.view):
+            raise Exception(f"Resource {index} ends past the end of the package")
+        return self.view[Start:End]
+
+    def ExtractAll(self, OutDir, NameFormat="{0}.bin"):
+        """ Writes every resource from the package buffer to its own file; returns the paths. """
+        if not self.Initialized:
+            raise Exception("You need to import before you can extract!")
+        os.makedirs(OutDir, exist_ok=True)
+        Paths = []
         for i in range(self.EntryCount):
-            EndPos = Offsets[i] + Sizes[i]
-            data = self.packget[EndPos + self.StartPos]
-            Files.append(FileEntry(data))
-        self.Initialized = True
-        return Files
+            Path = os.path.join(OutDir, NameFormat.format(i))
+            with open(Path, 'wb') as f:
+                f.write(self.GetResource(i))
+            Paths.append(Path)
+        return Paths
 
     def GetOffsetInfo(self, file, pos):
-        OffSize = PSBStrMan.ConvertSize(file[pos])
-        Count = PSBStrMan.ReadOffset(file, pos + 1, OffSize)
-        pos += 1 + OffSize
-        return [PSBStrMan.ConvertSize(file[pos]), pos + 1, Count]
+        Count, OffSize, TablePos = intarray.read_array_header(file, pos)
+        return [OffSize, TablePos, Count]
 
     def GetValues(self, file, pos):
-        tmp = self.GetOffsetInfo(file, pos)
-        Result = []
-        pos = tmp[1]
-        OffSize = tmp[0]
-        for i in range(tmp[2]):
-            Result.append(PSBStrMan.ReadOffset(file, pos + (i * OffSize), OffSize))
-        return Result
+        return intarray.read_int_array(file, pos)[0]
 
     def Export(self, Resources):
+        """ Returns the repacked package; see `Write` to stream it instead. """
+        Output = io.BytesIO()
+        self.Write(Resources, Output)
+        return Output.getvalue()
+
+    def Write(self, Resources, Output):
+        """ Streams the repacked package to a path or binary stream; returns the bytes written.
+
+        Resources can be `FileEntry`s, buffers, file paths, binary files or
+        iterables of chunks. Only the region before the resource data is held
+        in memory; blobs are copied (or deflated) to the output chunk by chunk.
+        With DedupResources, identical resources share one copy of their data
+        and SavedBytes tells how much was left out. Paths are written with
+        `write_via_temp`.
+        """
         if not self.Initialized:
             raise Exception("You need to import before you can export!")
         if len(Resources) != self.EntryCount:
             raise Exception("You can't add or delete resources!")
+        if is_path(Output):
+            return write_via_temp(Output, lambda f: self.Write(Resources, f))
+
+        with ExitStack() as stack:
+            Sources = []
+            Sizes = []
+            for Resource in Resources:
+                Source, Size = self.OpenResource(Resource, stack)
+                Sources.append(Source)
+                Sizes.append(Size)
+            if self.DedupResources:
+                with phase('resources.dedup', sum(Sizes)):
+                    Same = self.FindDuplicates(Sources, Sizes)
+            else:
+                Same = range(len(Sources))
+            Stored = [i for i, j in enumerate(Same) if i == j]
+            StoredOffsets, Padding, TotalSize = self.Layout([Sizes[i] for i in Stored])
+            OffsetOf = dict(zip(Stored, StoredOffsets))
+            Offsets = [OffsetOf[j] for j in Same]
+            self.SavedBytes = sum(Sizes) - sum(Sizes[i] for i in Stored)
+            MainData = self.CutAt(self.view, self.StartPos)
+            MainData[self.OffsetTablePos:self.OffsetTablePos + len(Offsets) * self.OffsetSize] = intarray.encode_uint_array(Offsets, self.OffsetSize)
+            MainData[self.ResSizeOffTablePos:self.ResSizeOffTablePos + len(Sizes) * self.ResSizeOffSize] = intarray.encode_uint_array(Sizes, self.ResSizeOffSize)
+
+            Segments = self.IterSegments(MainData, [Sources[i] for i in Stored], Padding)
+            if self.CompressPackget:
+                Written = write_segments(Output, [mdf.build_mdf_header(len(MainData) + TotalSize)])
+                return Written + compress_segments(Segments, self.CompressionLevel, Output)
+            Written = 0
+            with phase('resources.write') as timed:
+                for Segment in Segments:
+                    for Chunk in iter_chunks(Segment):
+                        Output.write(Chunk)
+                        Written += len(Chunk)
+                timed.nbytes = Written
+            return Written
+
+    def Layout(self, Sizes):
+        """ Resource offsets and the padding after each one, plus the resource data size.
+
+        With FixOffsets every resource but the last is followed by 1 to 4
+        bytes so the next one starts 4-byte aligned in the package.
+        """
+        Offsets = []
+        Padding = []
         TotalSize = 0
-        for i in range(len(Resources)):
-            TotalSize += len(Resources[i].Data) + (4 - ((self.StartPos + TotalSize + len(Resources[i].Data)) % 4)) if self.FixOffsets and i + 1 != len(Resources) else 0
-        ResTable = bytearray(TotalSize)
-        TotalSize = 0
-        MainData = self.CutAt(self.packget, self.StartPos)
-        for i in range(len(Resources)):
-            file = Resources[i].Data
-            ResTable[TotalSize:TotalSize + len(file)] = file
-            MainData[self.OffsetTablePos + (i * self.OffsetSize):self.OffsetTablePos + (i * self.OffsetSize) + self.OffsetSize] = PSBStrMan.CreateOffset(self.OffsetSize, TotalSize)
-            MainData[self.ResSizeOffTablePos + (i * self.ResSizeOffSize):self.ResSizeOffTablePos + (i * self.ResSizeOffSize) + self.ResSizeOffSize] = PSBStrMan.CreateOffset(self.ResSizeOffSize, len(file))
-            TotalSize += len(file) + (4 - ((self.StartPos + TotalSize + len(file)) % 4)) if self.FixOffsets and i + 1 != len(Resources) else 0
-        ResultPackget = bytearray(len(MainData) + len(ResTable))
-        ResultPackget[:len(MainData)] = MainData
-        ResultPackget[len(MainData):] = ResTable
-        return zlib.compress(ResultPackget, self.CompressionLevel) if self.CompressPackget else ResultPackget
+        for i, Size in enumerate(Sizes):
+            Offsets.append(TotalSize)
+            Pad = 0
+            if self.FixOffsets and i + 1 != len(Sizes):
+                Pad = 4 - ((self.StartPos + TotalSize + Size) % 4)
+            Padding.append(Pad)
+            TotalSize += Size + Pad
+        return Offsets, Padding, TotalSize
+
+    @staticmethod
+    def OpenResource(Resource, stack):
+        """ Returns a buffer or binary file for the resource and its size. """
+        if isinstance(Resource, FileEntry):
+            Resource = Resource.Data
+        if isinstance(Resource, (str, os.PathLike)):
+            Resource = stack.enter_context(open(Resource, 'rb'))
+            return Resource, os.fstat(Resource.fileno()).st_size
+        try:
+            View = memoryview(Resource).cast('B')
+            return View, len(View)
+        except TypeError:
+            pass
+        if hasattr(Resource, 'read'):
+            Start = Resource.tell()
+            Size = Resource.seek(0, 2) - Start
+            Resource.seek(Start)
+            return Resource, Size
+        # unknown size: spool the chunks, to disk past CHUNK_SIZE
+        Spool = stack.enter_context(SpooledTemporaryFile(CHUNK_SIZE))
+        for Chunk in Resource:
+            Spool.write(Chunk)
+        Size = Spool.tell()
+        Spool.seek(0)
+        return Spool, Size
+
+    @staticmethod
+    def FindDuplicates(Sources, Sizes):
+        """ For each resource, the index of the first one with the same content.
+
+        Only resources sharing their size with another one are hashed.
+        """
+        SizeCounts = Counter(Sizes)
+        First = {}
+        Same = []
+        for i, (Source, Size) in enumerate(zip(Sources, Sizes)):
+            if SizeCounts[Size] == 1:
+                Same.append(i)
+                continue
+            Digest = hashlib.sha256()
+            if hasattr(Source, 'read'):
+                Start = Source.tell()
+                for Chunk in iter_chunks(Source):
+                    Digest.update(Chunk)
+                Source.seek(Start)
+            else:
+                Digest.update(Source)
+            Same.append(First.setdefault((Size, Digest.digest()), i))
+        return Same
+
+    @staticmethod
+    def IterSegments(MainData, Sources, Padding):
+        yield MainData
+        for Source, Pad in zip(Sources, Padding):
+            yield Source
+            if Pad:
+                yield bytes(Pad)
 
     def CutAt(self, Original, Pos):
-        return Original[:Pos]
+        return bytearray(Original[:Pos])
 
 class FileEntry:
     def __init__(self, data):
@@ -92,56 +232,102 @@ class FileEntry:
 
 class HuffmanTool:
     @staticmethod
-    def DecompressBitmap(data):
-        stream = bytearray()
+    def DecompressBitmap(data, out=None):
+        """ Decodes into a buffer sized by a first pass over the commands.
+
+        Decodes into `out` (any writable buffer, e.g. a mmap of the output
+        file) when given, otherwise into a new bytearray; returns the buffer.
+        """
+        view = memoryview(data).cast('B')
+        End = len(view)
+        Size = HuffmanTool.DecompressedSize(view)
+        if out is None:
+            out = bytearray(Size)
+        elif len(out) < Size:
+            raise ValueError(f"Output buffer is smaller than the {Size} bytes bitmap")
+        target = memoryview(out).cast('B')
+        with phase('bitmap.decompress', Size):
+            pos = 0
+            i = 0
+            while i < End:
+                cmd = view[i]
+                if cmd & 0x80:
+                    Times = (cmd & 0x7F) + 3
+                    DW = view[i + 1:i + 5].tobytes()
+                    Length = Times * len(DW)
+                    target[pos:pos + Length] = DW * Times
+                    i += 5
+                else:
+                    Length = (cmd + 1) * 4
+                    Data = view[i + 1:i + 1 + Length]
+                    target[pos:pos + len(Data)] = Data
+                    i += Length + 1
+                    Length = len(Data)
+                pos += Length
+        return out
+
+    @staticmethod
+    def DecompressedSize(data):
+        """ Size of the decoded bitmap, reading only the command bytes. """
+        view = memoryview(data).cast('B')
+        End = len(view)
+        Size = 0
         i = 0
-        while i < len(data):
-            cmd = data[i]
-            if HuffmanTool.Repeat(cmd):
-                Times = HuffmanTool.GetInt(cmd) + 3
-                Data = data[i + 1:i + 5]
+        while i < End:
+            cmd = view[i]
+            if cmd & 0x80:
+                Size += ((cmd & 0x7F) + 3) * min(4, End - i - 1)
                 i += 5
-                for count in range(Times):
-                    stream.extend(Data)
             else:
-                Length = (HuffmanTool.GetInt(cmd) + 1) * 4
-                Data = data[i + 1:i + 1 + Length]
+                Length = (cmd + 1) * 4
+                Size += min(Length, End - i - 1)
                 i += Length + 1
-                stream.extend(Data)
-        return stream
+        return Size
 
     @staticmethod
     def CompressBitmap(data, JumpHeader):
-        if data[:2] == b'BM' and JumpHeader:
-            data = data[0x36:]
-        if len(data) % 4 > 0:
-            data += bytearray(len(data) % 4)
-        stream = bytearray()
+        """ Run-length encodes 32-bit pixels in one pass over the maximal runs of equal words.
+
+        Runs of 3+ words become repeat commands (0x80 | count - 3, word), up to
+        0x7F + 3 words each; everything else goes in literal blocks of at most
+        0x7F words. A run's 1 or 2 leftover words join the following literal block.
+        """
+        view = memoryview(data).cast('B')
+        if view[:2] == b'BM' and JumpHeader:
+            view = view[0x36:]
+        if len(view) % 4 > 0:
+            view = memoryview(bytes(view) + bytes(len(view) % 4))
         MaxInt = 0x7F
         MinVal = 3
-        pos = 0
-        while pos < len(data):
-            if HuffmanTool.HaveLoop(data, pos):
-                Loops = HuffmanTool.CountLoops(data, pos)
-                DW = data[pos:pos + 4]
-                while Loops > 0:
-                    length = min(Loops - MinVal, MaxInt)
-                    Loops -= length + MinVal
-                    stream.append(HuffmanTool.CreateInt(length))
-                    stream.extend(DW)
-                    pos += (length + MinVal) * 4
-            else:
-                length = 0
-                while not HuffmanTool.HaveLoop(data, pos + (length * 4)):
-                    length += 1
-                    if pos + (length * 4) >= len(data):
-                        break
-                while length > 0:
-                    off = min(length, MaxInt)
-                    stream.append(off - 1)
-                    stream.extend(data[pos:pos + off * 4])
-                    length -= off
-                    pos += off * 4
+        Words = len(view) // 4
+        # a trailing partial word never matches a full one
+        Total = (len(view) + 3) // 4
+        stream = bytearray()
+
+        def Literal(start, end):
+            while start < end:
+                off = min(end - start, MaxInt)
+                stream.append(off - 1)
+                stream.extend(view[start * 4:(start + off) * 4])
+                start += off
+
+        with phase('bitmap.compress', len(view)):
+            LiteralStart = 0
+            pos = 0
+            for DW, Run in groupby(view[:Words * 4].cast('I')):
+                Loops = len(list(Run))
+                if Loops >= MinVal:
+                    Literal(LiteralStart, pos)
+                    DWBytes = view[pos * 4:pos * 4 + 4]
+                    while Loops >= MinVal:
+                        length = min(Loops - MinVal, MaxInt)
+                        Loops -= length + MinVal
+                        stream.append(HuffmanTool.CreateInt(length))
+                        stream.extend(DWBytes)
+                        pos += length + MinVal
+                    LiteralStart = pos
+                pos += Loops
+            Literal(LiteralStart, Total)
         return stream
 
     @staticmethod
@@ -0,0 +1,197 @@
+import struct
+from array import array
+from .psbtype import PSBType
+
+# opcode kinds
+OP_INVALID = 0
+OP_SKIP = 1 # fixed width operand, no references
+OP_STRING = 2
+OP_LIST = 3
+OP_OBJECT = 4
+OP_INTEGER_ARRAY = 5
+OP_RESOURCE = 6
+
+def build_opcode_table():
+    """ Returns (kinds, widths) lists indexed by the PSB value tag byte. """
+    kinds = [OP_INVALID] * 256
+    widths = [0] * 256
+
+    def put(tag, kind, width=0):
+        kinds[tag] = kind
+        widths[tag] = width
+
+    # each tag takes the first matching branch of the former if/elif chain
+    for tag in range(256):
+        if PSBType.NONE <= tag <= PSBType.TRUE:
+            put(tag, OP_SKIP)
+        elif tag == PSBType.LIST:
+            put(tag, OP_LIST)
+        elif tag == PSBType.OBJECT:
+            put(tag, OP_OBJECT)
+        elif PSBType.STRING_N < tag <= PSBType.STRING_N + 4:
+            put(tag, OP_STRING, tag - PSBType.STRING_N)
+        elif tag == PSBType.DOUBLE:
+            put(tag, OP_SKIP, 8)
+        elif tag == PSBType.FLOAT0:
+            put(tag, OP_SKIP)
+        elif tag == PSBType.FLOAT:
+            put(tag, OP_SKIP, 4)
+        elif PSBType.INTEGER_N <= tag <= PSBType.INTEGER_N + 8:
+            put(tag, OP_SKIP, tag - PSBType.INTEGER_N)
+        elif PSBType.INTEGER_ARRAY_N < tag <= PSBType.INTEGER_ARRAY_N + 8:
+            put(tag, OP_INTEGER_ARRAY, tag - PSBType.INTEGER_ARRAY_N)
+        elif PSBType.RESOURCE_N < tag <= PSBType.RESOURCE_N + 4:
+            # resource references carry one extra byte before the index
+            put(tag, OP_RESOURCE, 1 + tag - PSBType.RESOURCE_N)
+        elif PSBType.EXTRA_N < tag <= PSBType.EXTRA_N + 4:
+            put(tag, OP_SKIP, tag - PSBType.EXTRA_N)
+        elif tag in (PSBType.COMPILER_INTEGER, PSBType.COMPILER_STRING,
+                PSBType.COMPILER_RESOURCE, PSBType.COMPILER_ARRAY,
+                PSBType.COMPILER_BOOL, PSBType.COMPILER_BINARY_TREE):
+            put(tag, OP_SKIP)
+    return kinds, widths
+
+OPCODE_KINDS, OPCODE_WIDTHS = build_opcode_table()
+
+# whole size of the values that need no further decoding, 0 for the others
+SKIP_SIZES = [1 + width if kind == OP_SKIP else 0 for kind, width in zip(OPCODE_KINDS, OPCODE_WIDTHS)]
+
+def read_uint24(data, pos):
+    return (int.from_bytes(data[pos:pos+3], 'little'),)
+
+UINT_READERS = {1: struct.Struct('<B').unpack_from, 2: struct.Struct('<H').unpack_from,
+    3: read_uint24, 4: struct.Struct('<I').unpack_from}
+
+# unpack_from style reader of the operand of each string reference tag
+STRING_READERS = [UINT_READERS[width] if kind == OP_STRING else None
+    for kind, width in zip(OPCODE_KINDS, OPCODE_WIDTHS)]
+
+class PSBScanner:
+    """ Iterative PSB bytecode walker collecting string references.
+
+    `ids` and `positions` are reused between scans: `ids[k]` is the string
+    index referenced by the value starting at bytecode offset `positions[k]`.
+    """
+    def __init__(self):
+        self.ids = array('Q')
+        self.positions = array('Q')
+        self.warning = False
+        self.embedded_reference = False
+
+    def reset(self):
+        del self.ids[:]
+        del self.positions[:]
+        self.warning = False
+        self.embedded_reference = False
+
+    def scan(self, script, start, end):
+        """ Walks all values in [start, end) and returns the reused `ids` buffer. """
+        self.reset()
+        self.walk(script, start, end)
+        return self.ids
+
+    def scan_value(self, script, index):
+        """ Walks a single value (with its children) and returns the next index. """
+        return self.walk(script, index, index + 1)
+
+    def walk(self, script, index, end):
+        assert index > 0, "wrong index"
+        kinds = OPCODE_KINDS
+        widths = OPCODE_WIDTHS
+        skips = SKIP_SIZES
+        string_readers = STRING_READERS
+        ids_append = self.ids.append
+        positions_append = self.positions.append
+        from_bytes = int.from_bytes
+        array_base = int(PSBType.INTEGER_ARRAY_N)
+
+        while index < end:
+            # LIST and OBJECT children follow their tag inline, so an explicit
+            # stack of pending values collapses into a single counter
+            pending = 1
+            while pending:
+                pending -= 1
+                value_type = script[index]
+                read_string = string_readers[value_type]
+                if read_string is not None:
+                    positions_append(index)
+                    ids_append(read_string(script, index + 1)[0])
+                    index += 1 + widths[value_type]
+                    continue
+                skip = skips[value_type]
+                if skip:
+                    index += skip
+                    continue
+                kind = kinds[value_type]
+                width = widths[value_type]
+                if kind == OP_LIST:
+                    index += 1
+                    pending += 1
+                elif kind == OP_OBJECT:
+                    index += 1
+                    pending += 2
+                elif kind == OP_INTEGER_ARRAY:
+                    index += 1
+                    count = from_bytes(script[index:index+width], 'little')
+                    index += width
+                    elength = script[index] - array_base
+                    assert elength > 0, "wrong integer elength"
+                    index += 1 + elength * count
+                elif kind == OP_RESOURCE:
+                    self.embedded_reference = True
+                    index += 1 + width
+                else:
+                    self.warning = True
+                    raise ValueError(f"Invalid PSB value: {hex(value_type).zfill(2)}")
+        return index
+
+class StringReferenceIndex:
+    """ String call-order and usage index built from a `PSBScanner` pass.
+
+    `order` lists string ids in first-use order followed by the unreferenced
+    ones, `referenced` is a per-id flag map and the bytecode offsets of all
+    uses of id `i` are `positions[starts[i]:starts[i + 1]]`.
+    """
+    def __init__(self, string_count, ids=(), positions=()):
+        referenced = bytearray(string_count)
+        counts = array('Q', bytes(8 * (string_count + 1)))
+        order = []
+        for string_id in ids:
+            if string_id < string_count:
+                counts[string_id + 1] += 1
+                if not referenced[string_id]:
+                    referenced[string_id] = 1
+                    order.append(string_id)
+        self.referenced_count = len(order)
+        order.extend(i for i in range(string_count) if not referenced[i])
+
+        # counting sort of the use offsets by string id
+        for i in range(string_count):
+            counts[i + 1] += counts[i]
+        cursor = array('Q', counts)
+        sorted_positions = array('Q', bytes(8 * counts[string_count]))
+        for string_id, position in zip(ids, positions):
+            if string_id < string_count:
+                sorted_positions[cursor[string_id]] = position
+                cursor[string_id] += 1
+
+        self.order = order
+        self.referenced = referenced
+        self.starts = counts
+        self.positions = sorted_positions
+
+    @classmethod
+    def from_scanner(cls, string_count, scanner: PSBScanner):
+        return cls(string_count, scanner.ids, scanner.positions)
+
+    def __len__(self):
+        return len(self.order)
+
+    def is_referenced(self, string_id):
+        return bool(self.referenced[string_id])
+
+    def uses(self, string_id):
+        return self.positions[self.starts[string_id]:self.starts[string_id + 1]]
+
+    def use_count(self, string_id):
+        return self.starts[string_id + 1] - self.starts[string_id]
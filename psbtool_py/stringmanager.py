@@ -1,22 +1,34 @@
-import struct
-import zlib
+import copy
+import mmap
 from .memreader import MemoryReader
-from .psbtype import PSB_MDF_SIGNATURE, PSB_SIGNATURE, PackageStatus, PSBType
-from .algorithms import PSBHeader
+from .psbtype import PSB_MDF_SIGNATURE, PSB_SIGNATURE, PackageStatus
+from .algorithms import PSBHeader, compress_segments, is_path, write_segments, write_via_temp
+from . import mdf
+from .stringtable import StringTable
+from . import intarray
+from .profiling import phase
 
 class PSBStrMan:
     def __init__(self, script):
-        self.script = bytearray(script)
+        # any buffer (bytes, bytearray, mmap, memoryview) is used as-is
+        self.script = script
         self.compressed_package = False # True
         self.compression_level = 9
         self.force_max_offset_length = False
+        self.share_strings = False # write each distinct string once, sharing suffixes
         self.off_length = 0
         self.str_count = 0
         self.old_off_tbl_len = 0
         self.old_str_dat_len = 0
         self.header = None
 
-    def import_strings(self):
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def import_strings(self, lazy=False):
+        """ Returns the strings as a list, or as a lazily decoded `StringTable`. """
         status = self.get_package_status(self.script)
         if status == PackageStatus.Invalid:
             raise Exception("Invalid Package")
@@ -25,55 +37,89 @@ class PSBStrMan:
             self.compressed_package = False #True
 
         with MemoryReader(self.script) as reader:
-            self.header = PSBHeader()
-            self.header.read_from_stream(reader)
-
-            reader.seek(self.header.str_off_pos)
-            size_type = reader.read_byte()
-            self.count_length = self.convert_size(size_type)
-            offsets = reader.read_bytes(self.count_length)
-            self.str_count = self.read_offset(offsets, 0, self.count_length)
-
-            length_type = reader.read_byte()
-            self.off_length = self.convert_size(length_type)
-            offsets = []
-            for _ in range(self.str_count):
-                offset_i = reader.read_bytes(self.off_length)
-                offsets.append(self.read_offset(offset_i, 0, self.off_length))
-
-            self.old_off_tbl_len = reader.position - self.header.str_off_pos
-
-            strings = []
-            reader.seek(self.header.str_data_pos)
-            for offset in offsets:
-                reader.seek(self.header.str_data_pos + offset)
-                strings.append(reader.read_cstring())
-
-            self.old_str_dat_len = reader.position - self.header.str_data_pos
+            with phase('psb.header'):
+                self.header = PSBHeader()
+                self.header.read_from_stream(reader)
+
+            with phase('psb.offsets') as timed:
+                reader.seek(self.header.str_off_pos)
+                size_type = reader.read_byte()
+                self.count_length = self.convert_size(size_type)
+                offsets = reader.read_bytes(self.count_length)
+                self.str_count = self.read_offset(offsets, 0, self.count_length)
+
+                length_type = reader.read_byte()
+                self.off_length = self.convert_size(length_type)
+                offsets = intarray.decode_uint_array(reader.view, reader.position, self.str_count, self.off_length)
+                reader.seek(self.str_count * self.off_length, 1)
+
+                self.old_off_tbl_len = reader.position - self.header.str_off_pos
+                timed.nbytes = self.old_off_tbl_len
+
+            with phase('psb.strings.decode', strings=self.str_count) as timed:
+                reader.seek(self.header.str_data_pos)
+                if lazy:
+                    strings = StringTable.from_cstrings(reader, self.header.str_data_pos, offsets, errors="unicodeescape")
+                else:
+                    strings = reader.read_cstrings(self.header.str_data_pos, offsets)
+
+                self.old_str_dat_len = reader.position - self.header.str_data_pos
+                timed.nbytes = self.old_str_dat_len
 
         return strings
 
     def export_strings(self, strings):
+        segments = self.build_export_plan(strings)
+        if self.compressed_package:
+            size = sum(len(segment) for segment in segments)
+            return mdf.build_mdf_header(size) + compress_segments(segments, self.compression_level)
+        with phase('psb.export.join') as timed:
+            package = b''.join(segments)
+            timed.nbytes = len(package)
+        return package
+
+    def write_strings(self, strings, output):
+        """ Writes the exported package to a path (see `write_via_temp`) or
+        binary stream without joining it first. """
+        if is_path(output):
+            return write_via_temp(output, lambda o: self.write_strings(strings, o))
+        segments = self.build_export_plan(strings)
+        if self.compressed_package:
+            return mdf.write_mdf(segments, output, self.compression_level)
+        with phase('psb.write') as timed:
+            written = write_segments(output, segments)
+            timed.nbytes = written
+        return written
+
+    def build_export_plan(self, strings):
+        """ Returns the segments of the exported package: views of the unchanged
+        original ranges interleaved with the new header and string tables. """
         if len(strings) != self.str_count:
             raise Exception("Strings number must be consistent with the original")
 
-        string_data, offsets = self.build_string_data(strings)
-        offset_data = self.build_offset_table(offsets)
+        with phase('psb.strings.encode', strings=len(strings)) as timed:
+            string_data, offsets = self.build_string_data(strings)
+            offset_data = self.build_offset_table(offsets)
+            timed.nbytes = len(string_data)
 
         off_tbl_diff = len(offset_data) - self.old_off_tbl_len
         str_dat_diff = len(string_data) - self.old_str_dat_len
 
-        header = self.header
-        header = self.update_offsets(header, off_tbl_diff, str_dat_diff)
-
-        out_script = bytearray(self.script)
-        out_script = self.overwrite_range(out_script, header.str_off_pos, self.old_off_tbl_len, offset_data)
-        out_script = self.overwrite_range(out_script, header.str_data_pos, self.old_str_dat_len, string_data)
-
+        old_header = self.header
+        header = self.update_offsets(copy.copy(old_header), off_tbl_diff, str_dat_diff)
         header_bytes = header.to_bytes()
-        out_script[:len(header_bytes)] = header_bytes
 
-        return zlib.compress(out_script, self.compression_level) if self.compressed_package else out_script
+        script = memoryview(self.script)
+        off_tbl_end = old_header.str_off_pos + self.old_off_tbl_len
+        str_dat_end = old_header.str_data_pos + self.old_str_dat_len
+        return [
+            header_bytes,
+            script[len(header_bytes):old_header.str_off_pos],
+            offset_data,
+            script[off_tbl_end:old_header.str_data_pos],
+            string_data,
+            script[str_dat_end:],
+        ]
 
     def overwrite_range(self, original_data, start, length, data_to_overwrite):
         return original_data[:start] + data_to_overwrite + original_data[start + length:]
@@ -98,37 +144,59 @@ class PSBStrMan:
         return offset + diff
 
     def build_string_data(self, strings):
+        if self.share_strings:
+            return self.build_shared_string_data(strings)
         offsets = []
         string_data = bytearray()
 
-        for string in strings:
+        for data in StringTable.encode_all(strings, "utf-8"):
             offsets.append(len(string_data))
-            string_data.extend(string.encode("utf-8") + b'\0')
+            string_data.extend(data)
+            string_data.append(0)
 
         return string_data, offsets
 
-    def build_offset_table(self, offsets):
-        offset_data = bytearray()
+    @staticmethod
+    def build_shared_string_data(strings):
+        """ Writes every distinct string once; a string that is the tail of another
+        one points into it and reuses its NUL terminator. """
+        encoded = StringTable.encode_all(strings, "utf-8")
+
+        # sorted by reversed bytes, a suffix sits right before the strings ending with it
+        by_suffix = sorted(set(encoded), key=lambda data: data[::-1])
+        owners = {}
+        for i in range(len(by_suffix) - 1, -1, -1):
+            data = by_suffix[i]
+            if i + 1 < len(by_suffix) and by_suffix[i + 1].endswith(data):
+                owners[data] = owners[by_suffix[i + 1]]
+            else:
+                owners[data] = data
 
-        offset_size = 4 if self.force_max_offset_length else self.get_min_int_len(self.str_count)
-        offset_data.append(self.unconvert_size(offset_size))
-        offset_data.extend(self.create_offset(offset_size, self.str_count))
+        offsets = []
+        positions = {}
+        string_data = bytearray()
+        for data in encoded:
+            owner = owners[data]
+            position = positions.get(owner)
+            if position is None:
+                position = positions[owner] = len(string_data)
+                string_data.extend(owner + b'\0')
+            offsets.append(position + len(owner) - len(data))
 
-        offset_size = 4 if self.force_max_offset_length else self.get_min_int_len(offsets[-1])
-        offset_data.append(self.unconvert_size(offset_size))
+        return string_data, offsets
 
-        for offset in offsets:
-            offset_data.extend(self.create_offset(offset_size, offset))
+    def build_offset_table(self, offsets):
+        count_size = 4 if self.force_max_offset_length else self.get_min_int_len(self.str_count)
+        offset_size = 4 if self.force_max_offset_length else self.get_min_int_len(max(offsets))
+        return intarray.build_int_array(offsets, offset_size, count_size)
 
-        return offset_data
+    @staticmethod
+    def compress_mdf(psb, compression=9):
+        return mdf.compress_mdf(psb, compression)
 
     @staticmethod
-    def compress_mdf(psb):
-        compressed_script = zlib.compress(psb)
-        ret_data = bytearray('')
-        ret_data.extend(struct.pack("<I", len(psb)))
-        ret_data.extend(compressed_script)
-        return ret_data
+    def extract_mdf(package):
+        return mdf.extract_mdf(package)
 
     def try_recovery(self):
         script = bytearray(self.script)
@@ -151,9 +219,9 @@ class PSBStrMan:
 
         seq = bytearray([0xD, 0x0, 0xD])
         if self.equals_at(script, seq, end_str + 1) and self.equals_at(script, seq, end_str + 1 + len(seq)):
-            self.overwrite_range(script, 0x18, 4, self.create_offset(4, end_str + 1))
-            self.overwrite_range(script, 0x1C, 4, self.create_offset(4, end_str + 4))
-            self.overwrite_range(script, 0x20, 4, self.create_offset(4, end_str + 7))
+            script = self.overwrite_range(script, 0x18, 4, self.create_offset(4, end_str + 1))
+            script = self.overwrite_range(script, 0x1C, 4, self.create_offset(4, end_str + 4))
+            script = self.overwrite_range(script, 0x20, 4, self.create_offset(4, end_str + 7))
             return self.compress_mdf(script) if mdf else script
         else:
             try:
@@ -172,32 +240,16 @@ class PSBStrMan:
                 return False
         return True
 
-    @staticmethod
-    def get_min_int_len(value):
-        min_len = 0
-        while value >> (min_len * 8) > 0:
-            min_len += 1
-        return min_len
+    get_min_int_len = staticmethod(intarray.min_int_len)
+    convert_size = staticmethod(intarray.convert_size)
+    unconvert_size = staticmethod(intarray.unconvert_size)
 
     @staticmethod
     def create_offset(length, value: int):
-        if value >= (length << 15):
+        if value > intarray.max_value(length):
             raise Exception(f"Offset {value} is too big for its byte size 2^({length} * 8)")
         return value.to_bytes(length, 'little')
 
-    @staticmethod
-    def convert_size(sz_val):
-        size = sz_val - PSBType.INTEGER_ARRAY_N
-        if 9 <= size <= 0:
-            raise ValueError(f"{sz_val} is not an INTEGER_ARRAY_N")
-        return size
-
-    @staticmethod
-    def unconvert_size(size):
-        if size < 9:
-            return PSBType.INTEGER_ARRAY_N + size
-        raise ValueError("Arrays can have maximum 8 byte size")
-
     @staticmethod
     def read_offset(data, index, length):
         return int.from_bytes(data[index:index+length], 'little')
@@ -0,0 +1,142 @@
+from array import array
+from itertools import accumulate
+
+class StringTable:
+    """ Lazily decoded string table: one raw buffer plus start/end offset arrays.
+
+    Behaves like the list of strings it replaces (len, indexing, iteration,
+    assignment, index/count) but decodes an entry only when it is read.
+    Assigned strings are kept aside, so the raw buffer is never modified.
+    `raw(i)` gives the encoded entry as `bytes`, whatever buffer backs the
+    table, for cheap comparisons and hashing (e.g. as dict keys) without
+    decoding.
+    """
+    def __init__(self, data, starts, ends, encoding='utf-8', errors='strict'):
+        self.data = data
+        self.starts = starts
+        self.ends = ends
+        self.encoding = encoding
+        self.errors = errors
+        self.overrides = {}
+
+    @classmethod
+    def from_cstrings(cls, reader, base, offsets, encoding='utf-8', errors='strict'):
+        """ Table of the NUL terminated strings at `base + offset` of a `MemoryReader`.
+
+        Copies the string region once and leaves the reader after it.
+        """
+        if not len(offsets):
+            return cls(b'', array('Q'), array('Q'), encoding, errors)
+        region_end = reader.cstring_end(base + max(offsets))
+        data = bytes(reader.view[base:region_end]) + b'\0'
+        reader.seek(region_end + 1)
+
+        # terminator positions of the sequential strings, then the odd ones
+        ends_by_start = {}
+        start = 0
+        for length in accumulate(len(part) + 1 for part in data[:-1].split(b'\0')):
+            ends_by_start[start] = length - 1
+            start = length
+        starts = array('Q', offsets)
+        ends = array('Q', bytes(8 * len(offsets)))
+        find = data.find
+        for i, offset in enumerate(offsets):
+            string_end = ends_by_start.get(offset)
+            if string_end is None:
+                string_end = find(b'\0', offset)
+            ends[i] = string_end
+        return cls(data, starts, ends, encoding, errors)
+
+    @classmethod
+    def from_strings(cls, strings, encoding='utf-8', errors='strict'):
+        encoded = [string.encode(encoding, errors) for string in strings]
+        ends = array('Q', accumulate(len(data) for data in encoded))
+        starts = array('Q', [0]) + ends[:-1] if encoded else array('Q')
+        return cls(b''.join(encoded), starts, ends, encoding, errors)
+
+    @staticmethod
+    def encode_all(strings, encoding='utf-8'):
+        """ Encoded bytes of every string of a list or `StringTable`. """
+        if isinstance(strings, StringTable) and strings.encoding == encoding:
+            # untouched entries are copied raw, without a decode/encode round trip
+            return [strings.raw(i) for i in range(len(strings))]
+        return [string.encode(encoding) for string in strings]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def raw(self, index):
+        if index < 0:
+            index += len(self.starts)
+        if index in self.overrides:
+            return self.overrides[index].encode(self.encoding, self.errors)
+        value = self.data[self.starts[index]:self.ends[index]]
+        # the table may sit on a memoryview or bytearray, keys must be hashable
+        return value if type(value) is bytes else bytes(value)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self.starts)
+        override = self.overrides.get(index)
+        if override is not None:
+            return override
+        return str(self.data[self.starts[index]:self.ends[index]], self.encoding, self.errors)
+
+    def __setitem__(self, index, value):
+        if index < 0:
+            index += len(self.starts)
+        if not 0 <= index < len(self.starts):
+            raise IndexError("string table index out of range")
+        self.overrides[index] = value
+
+    def __iter__(self):
+        for i in range(len(self.starts)):
+            yield self[i]
+
+    def __contains__(self, value):
+        try:
+            self.index(value)
+        except ValueError:
+            return False
+        return True
+
+    def index(self, value):
+        needle = value.encode(self.encoding, self.errors)
+        for i in range(len(self.starts)):
+            if self.raw(i) == needle:
+                return i
+        raise ValueError(f"{value!r} is not in the string table")
+
+    def count(self, value):
+        needle = value.encode(self.encoding, self.errors)
+        return sum(1 for i in range(len(self.starts)) if self.raw(i) == needle)
+
+    def reorder(self, mapping):
+        """ New table over the same buffer with entry `i` taken from `mapping[i]`. """
+        table = StringTable(self.data,
+            array('Q', (self.starts[j] for j in mapping)),
+            array('Q', (self.ends[j] for j in mapping)),
+            self.encoding, self.errors)
+        if self.overrides:
+            for i, j in enumerate(mapping):
+                if j in self.overrides:
+                    table.overrides[i] = self.overrides[j]
+        return table
+
+    def tolist(self):
+        return list(self)
+
+    def __eq__(self, other):
+        if isinstance(other, StringTable):
+            return (len(self) == len(other) and self.encoding == other.encoding
+                and all(self.raw(i) == other.raw(i) for i in range(len(self))))
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None # mutable, hash entries through raw() instead
+
+    def __repr__(self):
+        return f"<StringTable of {len(self)} strings>"
@@ -1,22 +1,188 @@
 import struct
 import io
 
+FIELD_FORMATS = {int: 'i', float: 'f', bool: '?'}
+
+_plans = {}
+
+def compile_struct(struct_type, big_endian=False):
+    """ Returns the cached `StructPlan` of a `Struct` subclass, compiling it on first use. """
+    key = (struct_type, big_endian)
+    plan = _plans.get(key)
+    if plan is None:
+        plan = _plans[key] = StructPlan(struct_type, big_endian)
+    return plan
+
+def assign_fields(instance, layout, values, index=0):
+    """ Sets the fields of `layout` from the flat unpacked `values`; returns the next index. """
+    for name, plan in layout:
+        if plan is None:
+            setattr(instance, name, values[index])
+            index += 1
+        else:
+            child = plan.struct_type()
+            index = assign_fields(child, plan.layout, values, index)
+            setattr(instance, name, child)
+    return index
+
+def flatten_fields(instance, layout, values):
+    for name, plan in layout:
+        if plan is None:
+            values.append(getattr(instance, name))
+        else:
+            flatten_fields(getattr(instance, name), plan.layout, values)
+    return values
+
+class StructPlan:
+    """ Compiled layout of a `Struct` subclass.
+
+    Runs of fixed-size fields, nested fixed-size structs included, become a
+    single precompiled `struct.Struct`; strings, bytes and variable-size
+    nested structs are separate length-prefixed steps. A plan without such
+    steps is `fixed` and has one `codec` for the whole record.
+    """
+    def __init__(self, struct_type, big_endian=False):
+        self.struct_type = struct_type
+        self.big_endian = big_endian
+        self.byte_order = '>' if big_endian else '<'
+        self.length = struct.Struct(self.byte_order + 'i')
+        self.steps = [] # ('fixed', codec, layout) or (kind, name, nested plan)
+
+        fmt = ''
+        layout = []
+        def flush():
+            nonlocal fmt, layout
+            if layout:
+                self.steps.append(('fixed', struct.Struct(self.byte_order + fmt), layout))
+            fmt = ''
+            layout = []
+
+        self.format = ''
+        for name, field_type in getattr(struct_type, '__annotations__', {}).items():
+            if field_type in FIELD_FORMATS:
+                fmt += FIELD_FORMATS[field_type]
+                layout.append((name, None))
+            elif isinstance(field_type, type) and issubclass(field_type, Struct):
+                plan = compile_struct(field_type, big_endian)
+                if plan.fixed:
+                    fmt += plan.format
+                    layout.append((name, plan))
+                else:
+                    flush()
+                    self.steps.append(('struct', name, plan))
+            elif field_type in (str, bytes):
+                flush()
+                self.steps.append((field_type.__name__, name, None))
+            else:
+                raise ValueError(f"Unsupported field type: {field_type}")
+        whole_format = fmt
+        flush()
+
+        self.fixed = all(step[0] == 'fixed' for step in self.steps)
+        if self.fixed:
+            self.format = whole_format
+            self.codec = struct.Struct(self.byte_order + whole_format)
+            self.layout = self.steps[0][2] if self.steps else []
+            self.size = self.codec.size
+        else:
+            self.codec = None
+            self.layout = None
+            self.size = None
+
+    def read(self, stream, encoding='utf-8', instance=None):
+        """ Reads one record from a binary stream. """
+        if instance is None:
+            instance = self.struct_type()
+        for kind, codec, layout in self.steps:
+            if kind == 'fixed':
+                assign_fields(instance, layout, codec.unpack(stream.read(codec.size)))
+            elif kind == 'struct':
+                setattr(instance, codec, layout.read(stream, encoding))
+            else:
+                data = stream.read(self.length.unpack(stream.read(4))[0])
+                setattr(instance, codec, data.decode(encoding) if kind == 'str' else data)
+        return instance
+
+    def unpack_from(self, buffer, offset=0, encoding='utf-8'):
+        """ Reads one record from a buffer; returns (instance, end offset). """
+        instance = self.struct_type()
+        for kind, codec, layout in self.steps:
+            if kind == 'fixed':
+                assign_fields(instance, layout, codec.unpack_from(buffer, offset))
+                offset += codec.size
+            elif kind == 'struct':
+                child, offset = layout.unpack_from(buffer, offset, encoding)
+                setattr(instance, codec, child)
+            else:
+                length = self.length.unpack_from(buffer, offset)[0]
+                data = bytes(buffer[offset + 4:offset + 4 + length])
+                offset += 4 + length
+                setattr(instance, codec, data.decode(encoding) if kind == 'str' else data)
+        return instance, offset
+
+    def iter_unpack(self, buffer, offset=0, count=None, encoding='utf-8'):
+        """ Yields `count` consecutive records from a buffer (all remaining
+        ones when None); fixed-size records go through `struct.iter_unpack`. """
+        if self.fixed and self.size:
+            view = memoryview(buffer).cast('B')
+            if count is None:
+                count = (len(view) - offset) // self.size
+            end = offset + count * self.size
+            if end > len(view):
+                raise ValueError(f"Buffer too small for {count} records of {self.size} bytes")
+            layout = self.layout
+            struct_type = self.struct_type
+            for values in self.codec.iter_unpack(view[offset:end]):
+                instance = struct_type()
+                assign_fields(instance, layout, values)
+                yield instance
+            return
+        if count is None:
+            raise ValueError("Records without a fixed size need an explicit count")
+        for _ in range(count):
+            instance, offset = self.unpack_from(buffer, offset, encoding)
+            yield instance
+
+    def pack(self, instance, encoding='utf-8'):
+        if self.fixed:
+            return self.codec.pack(*flatten_fields(instance, self.layout, []))
+        parts = []
+        for kind, codec, layout in self.steps:
+            if kind == 'fixed':
+                parts.append(codec.pack(*flatten_fields(instance, layout, [])))
+            elif kind == 'struct':
+                parts.append(layout.pack(getattr(instance, codec), encoding))
+            else:
+                data = getattr(instance, codec)
+                if kind == 'str':
+                    data = data.encode(encoding)
+                parts.append(self.length.pack(len(data)))
+                parts.append(data)
+        return b''.join(parts)
+
 class StructReader:
     def __init__(self, stream, big_endian=False, encoding=None):
         self.stream = stream
         self.big_endian = big_endian
         self.encoding = encoding if encoding else 'utf-8'
+        order = '>' if big_endian else '<'
+        self.int_codec = struct.Struct(order + 'i')
+        self.float_codec = struct.Struct(order + 'f')
+        self.bool_codec = struct.Struct(order + '?')
 
     def read_struct(self, struct_type):
-        instance = struct_type()
-        self.read_fields(struct_type, instance)
-        return instance
+        return compile_struct(struct_type, self.big_endian).read(self.stream, self.encoding)
+
+    def read_structs(self, struct_type, count):
+        """ Reads `count` consecutive records, fixed-size ones with a single read. """
+        plan = compile_struct(struct_type, self.big_endian)
+        if plan.fixed:
+            data = self.stream.read(plan.size * count)
+            return list(plan.iter_unpack(data, 0, count))
+        return [plan.read(self.stream, self.encoding) for _ in range(count)]
 
     def read_fields(self, struct_type, instance):
-        fields = struct_type.__annotations__.items()
-        for field_name, field_type in fields:
-            value = self.read_field(field_type)
-            setattr(instance, field_name, value)
+        compile_struct(struct_type, self.big_endian).read(self.stream, self.encoding, instance)
 
     def read_field(self, field_type):
         if field_type == str:
@@ -40,22 +206,13 @@ class StructReader:
         return data.decode(self.encoding)
 
     def read_int(self):
-        size = struct.calcsize('i')
-        data = self.stream.read(size)
-        value = struct.unpack('i', data)[0]
-        return value
+        return self.int_codec.unpack(self.stream.read(self.int_codec.size))[0]
 
     def read_float(self):
-        size = struct.calcsize('f')
-        data = self.stream.read(size)
-        value = struct.unpack('f', data)[0]
-        return value
+        return self.float_codec.unpack(self.stream.read(self.float_codec.size))[0]
 
     def read_bool(self):
-        size = struct.calcsize('?')
-        data = self.stream.read(size)
-        value = struct.unpack('?', data)[0]
-        return value
+        return self.bool_codec.unpack(self.stream.read(self.bool_codec.size))[0]
 
     def read_bytes(self):
         length = self.read_int()
@@ -67,15 +224,21 @@ class StructWriter:
         self.stream = stream
         self.big_endian = big_endian
         self.encoding = encoding if encoding else 'utf-8'
+        order = '>' if big_endian else '<'
+        self.int_codec = struct.Struct(order + 'i')
+        self.float_codec = struct.Struct(order + 'f')
+        self.bool_codec = struct.Struct(order + '?')
 
     def write_struct(self, struct_instance):
         self.write_fields(struct_instance)
 
+    def write_structs(self, struct_instances):
+        for struct_instance in struct_instances:
+            self.write_fields(struct_instance)
+
     def write_fields(self, struct_instance):
-        fields = struct_instance.__annotations__.items()
-        for field_name, field_type in fields:
-            value = getattr(struct_instance, field_name)
-            self.write_field(value, field_type)
+        plan = compile_struct(type(struct_instance), self.big_endian)
+        self.stream.write(plan.pack(struct_instance, self.encoding))
 
     def write_field(self, value, field_type):
         if field_type == str:
@@ -100,16 +263,13 @@ class StructWriter:
         self.stream.write(encoded_value)
 
     def write_int(self, value):
-        data = struct.pack('i', value)
-        self.stream.write(data)
+        self.stream.write(self.int_codec.pack(value))
 
     def write_float(self, value):
-        data = struct.pack('f', value)
-        self.stream.write(data)
+        self.stream.write(self.float_codec.pack(value))
 
     def write_bool(self, value):
-        data = struct.pack('?', value)
-        self.stream.write(data)
+        self.stream.write(self.bool_codec.pack(value))
 
     def write_bytes(self, value):
         length = len(value)
@@ -1,21 +1,32 @@
+import mmap
 import struct
 import codecs
-from io import IOBase, BytesIO
+from array import array
+from io import BytesIO, UnsupportedOperation
+from .algorithms import is_path, write_segments, write_via_temp
+from .stringtable import StringTable
+from .tjs2scanner import TJS2ReferenceIndex
+from .profiling import phase
+
+TJS2_SIGNATURE = b'TJS2100\0'
+UINT = struct.Struct('<I')
 
 class Sector:
+    """ A typed chunk of a TJS2 file. `content` is a view of the source
+    buffer until it is replaced, so untouched sectors are never copied. """
     def __init__(self, data, pos):
-        data.seek(pos)
-        self.type = data.read(4).decode('ascii')
-        data_length = struct.unpack('<I', data.read(4))[0]
-        self.content = data.read(data_length)
+        self.type = bytes(data[pos:pos + 4]).decode('ascii')
+        data_length = struct.unpack_from('<I', data, pos + 4)[0]
+        if pos + 8 + data_length > len(data):
+            raise Exception("Corrupted or incompatible .tjs file")
+        self.content = data[pos + 8:pos + 8 + data_length]
         self.full_length = data_length + 8
 
+    def segments(self):
+        return [self.type.encode('ascii') + struct.pack('<I', len(self.content)), self.content]
+
     def generate(self):
-        sector = bytearray()
-        sector.extend(self.type.encode('ascii'))
-        sector.extend(struct.pack('<I', len(self.content)))
-        sector.extend(self.content)
-        return sector
+        return bytearray().join(self.segments())
 
 def read_uint(data, pos):
     data.seek(pos)
@@ -24,37 +35,49 @@ def read_uint(data, pos):
 def generate_uint(value):
     return struct.pack('<I', value)
 
-def parse_tjs(tjs2: IOBase):
-    tjs2_len = read_uint(tjs2, 8)
-    tjs2.seek(0, 2)
-    if tjs2_len != tjs2.tell():
+def map_tjs(tjs2):
+    """ Read-only view of a whole TJS2 file given as a stream or a buffer; real files are mapped. """
+    if isinstance(tjs2, BytesIO):
+        return memoryview(tjs2.getvalue())
+    if hasattr(tjs2, 'read'):
+        try:
+            return memoryview(mmap.mmap(tjs2.fileno(), 0, access=mmap.ACCESS_READ))
+        except (AttributeError, OSError, ValueError, UnsupportedOperation):
+            tjs2.seek(0)
+            return memoryview(tjs2.read())
+    return memoryview(tjs2).cast('B')
+
+def parse_tjs(tjs2):
+    data = map_tjs(tjs2)
+    if len(data) < 12 or struct.unpack_from('<I', data, 8)[0] != len(data):
         raise Exception("Corrupted or incompatible .tjs file")
     # first sector is data
     pointer = 12
-    data = Sector(tjs2, pointer)
-    pointer += data.full_length
+    data_sector = Sector(data, pointer)
+    pointer += data_sector.full_length
 
     other = []
-    other_length = read_uint(tjs2, pointer)
+    other_length = struct.unpack_from('<I', data, pointer)[0]
     pointer += 4
     for _ in range(other_length):
-        sector = Sector(tjs2, pointer)
+        sector = Sector(data, pointer)
         pointer += sector.full_length
         other.append(sector)
 
     tjs = []
-    tjs_length = read_uint(tjs2, pointer)
+    tjs_length = struct.unpack_from('<I', data, pointer)[0]
     pointer += 4
     for _ in range(tjs_length):
-        sector = Sector(tjs2, pointer)
+        sector = Sector(data, pointer)
         pointer += sector.full_length
         tjs.append(sector)
 
     # merge sector arrays
-    sectors = [data] + other + tjs
+    sectors = [data_sector] + other + tjs
     return sectors
 
-def merge_sectors(sectors):
+def sector_segments(sectors):
+    """ Buffers of the rebuilt file in order: header, DATA, other sectors, TJS2 sectors. """
     data = None
     other = []
     tjs = []
@@ -66,85 +89,81 @@ def merge_sectors(sectors):
         else:
             other.append(sector)
 
-    # data segment and header
-    out_tjs2 = bytearray()
-    out_tjs2.extend(bytearray(b'TJS2100\0')) # signature & version
-    out_tjs2.extend(b'\0\0\0\0') # file length placeholder
-    out_tjs2.extend(data.generate())
-
-    # other segments
-    out_tjs2.extend(generate_uint(len(other)))
+    segments = data.segments()
+    segments.append(generate_uint(len(other)))
     for sector in other:
-        out_tjs2.extend(sector.generate())
-
-    # TJS2 segments
-    out_tjs2.extend(generate_uint(len(tjs)))
+        segments += sector.segments()
+    segments.append(generate_uint(len(tjs)))
     for sector in tjs:
-        out_tjs2.extend(sector.generate())
+        segments += sector.segments()
+
+    # signature, version and file length
+    length = 12 + sum(len(segment) for segment in segments)
+    return [TJS2_SIGNATURE + generate_uint(length)] + segments
 
-    # fill the file length placeholder
-    out_tjs2[0x08:0x0C] = generate_uint(len(out_tjs2))
+def merge_sectors(sectors):
+    return bytearray().join(sector_segments(sectors))
 
-    return out_tjs2
+def write_sectors(sectors, output):
+    """ Writes the rebuilt file to a binary stream, unchanged sectors straight from the source. """
+    return write_segments(output, sector_segments(sectors))
 
-def get_strings(sector):
+def get_strings(sector, lazy=False):
     if sector.type != "DATA":
         raise Exception("Sector Type Not Supported")
-    data = BytesIO(sector.content)
-
-    str_pos = find_string_pos(data)
-
-    strings = []
-    string_count = read_uint(data, str_pos)
+    if lazy:
+        return get_string_table(sector)
+    content = sector.content
+    starts, ends, _ = scan_string_table(content, find_string_pos(content))
+    return [codecs.decode(content[start:end], 'utf-16le') for start, end in zip(starts, ends)]
+
+def get_string_table(sector):
+    """ Lazily decoded `StringTable` over the DATA sector content. """
+    content = sector.content
+    starts, ends, _ = scan_string_table(content, find_string_pos(content))
+    return StringTable(content, array('Q', starts), array('Q', ends), 'utf-16le')
+
+def scan_string_table(content, str_pos):
+    """ One pass over the string table: the start and end of every string's
+    UTF-16 data, and the position right after the table. """
+    unpack_from = UINT.unpack_from
+    string_count = unpack_from(content, str_pos)[0]
     str_pos += 4
-    for _ in range(string_count):
-        string_length = read_uint(data, str_pos) * 2
-        str_pos += 4
-        string = codecs.decode(data.read(string_length), 'utf-16le')
-        strings.append(string)
-        str_pos += string_length
-        str_pos = round_up(str_pos, 4)
-
-    return strings
+    starts = [0] * string_count
+    ends = [0] * string_count
+    for i in range(string_count):
+        end = str_pos + 4 + unpack_from(content, str_pos)[0] * 2
+        starts[i] = str_pos + 4
+        ends[i] = end
+        str_pos = (end + 3) & ~3
+    return starts, ends, str_pos
 
 def set_strings(sector, strings):
     if sector.type != "DATA":
         raise Exception("Sector Type Not Supported")
-    data = BytesIO(sector.content)
+    content = sector.content
 
     # load positions
-    str_pos = find_string_pos(data)
-    end_pos = find_str_end(str_pos, data)
-
-    # copy non-string data
-    data.seek(0)
-    values = data.read(str_pos)
-
-    string_table = bytearray()
-    string_table.extend(generate_uint(len(strings))) # String Count
-
-    # generate string table
-    for string in strings:
-        string_length = round_up(len(string) * 2, 4)
-        string_entry = bytearray()
-        string_entry.extend(generate_uint(len(string)))
-        new_str = codecs.encode(string, 'utf-16le')
-        string_entry.extend(new_str)
-        string_entry.extend((string_length - len(new_str)) * b'\0') # padding
-        string_table.extend(string_entry)
-
-    # copy object values
-    data.seek(end_pos)
-    objs = data.read()
-
-    # generate sector content
-    new_content = bytearray()
-    new_content.extend(values)
-    new_content.extend(string_table)
-    new_content.extend(objs)
-
-    # Return
-    sector.content = bytes(new_content)
+    str_pos = find_string_pos(content)
+    end_pos = scan_string_table(content, str_pos)[2]
+
+    # entries are a char count and the UTF-16 data, padded to 4 bytes
+    encoded = StringTable.encode_all(strings, 'utf-16le')
+    lengths = [len(entry) for entry in encoded]
+    table_length = 4 + 4 * len(lengths) + sum((length + 3) & ~3 for length in lengths)
+    new_content = bytearray(str_pos + table_length + len(content) - end_pos)
+    new_content[:str_pos] = content[:str_pos]
+    pack_into = UINT.pack_into
+    pack_into(new_content, str_pos, len(encoded))
+    pos = str_pos + 4
+    for entry, length in zip(encoded, lengths):
+        pack_into(new_content, pos, length >> 1)
+        pos += 4
+        new_content[pos:pos + length] = entry
+        pos += (length + 3) & ~3
+    new_content[pos:] = content[end_pos:]
+
+    sector.content = new_content
 
 def append(data_table, data_to_append):
     return data_table + data_to_append
@@ -153,51 +172,80 @@ def append_sector(data_table, sector_to_append):
     return data_table + [sector_to_append]
 
 def find_str_end(str_pos, data):
-    count = read_uint(data, str_pos)
-    str_pos += 4
-    for _ in range(count):
-        length = read_uint(data, str_pos)
-        str_pos += 4 + round_up(length * 2, 4)
-    return str_pos
+    return scan_string_table(data, str_pos)[2]
 
 def find_string_pos(data):
-    str_pos = read_uint(data, 0) + 4 # skip 8 bits array
+    unpack_from = UINT.unpack_from
+    str_pos = unpack_from(data, 0)[0] + 4 # skip 8 bits array
     str_pos = round_up(str_pos, 4)
 
-    str_pos += (read_uint(data, str_pos) * 2) + 4 # skip 16 bits array
+    str_pos += (unpack_from(data, str_pos)[0] * 2) + 4 # skip 16 bits array
     str_pos = round_up(str_pos, 4)
 
-    str_pos += (read_uint(data, str_pos) * 4) + 4 # skip 32 bits array
+    str_pos += (unpack_from(data, str_pos)[0] * 4) + 4 # skip 32 bits array
     str_pos = round_up(str_pos, 4)
 
-    str_pos += (read_uint(data, str_pos) * 8) + 4 # skip 64 bits array
+    str_pos += (unpack_from(data, str_pos)[0] * 8) + 4 # skip 64 bits array
     str_pos = round_up(str_pos, 4)
 
-    str_pos += (read_uint(data, str_pos) * 8) + 4 # skip 64 bits unknown (IEEE Float?)
+    str_pos += (unpack_from(data, str_pos)[0] * 8) + 4 # skip 64 bits unknown (IEEE Float?)
     str_pos = round_up(str_pos, 4)
 
     return str_pos
 
 def round_up(value, multiplier):
-    while value % multiplier != 0:
-        value += 1
-    return value
+    return -(-value // multiplier) * multiplier
 
 class TJS2SManager:
     def __init__(self, script):
-        self.sectors = parse_tjs(script)
+        with phase('tjs2.parse'):
+            self.sectors = parse_tjs(script)
+        self.references = None
         for i, sector in enumerate(self.sectors):
             if sector.type == "DATA":
                 self.data_index = i
                 return
         raise Exception("Failed to parse TJS file")
 
-    def import_strings(self):
-        return get_strings(self.sectors[self.data_index])
+    @classmethod
+    def from_file(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f)
+
+    def build_references(self):
+        """ Indexes which code objects and instructions use each string constant. """
+        content = self.sectors[self.data_index].content
+        string_count = UINT.unpack_from(content, find_string_pos(content))[0]
+        with phase('tjs2.references', strings=string_count):
+            self.references = TJS2ReferenceIndex.from_sectors(string_count, self.sectors)
+        return self.references
+
+    def import_strings(self, lazy=False):
+        sector = self.sectors[self.data_index]
+        with phase('tjs2.strings.decode', len(sector.content)) as timed:
+            strings = get_strings(sector, lazy)
+            timed.strings = len(strings)
+        return strings
 
     def export_strings(self, strings):
-        set_strings(self.sectors[self.data_index], strings)
-        return merge_sectors(self.sectors)
+        with phase('tjs2.strings.encode', strings=len(strings)):
+            set_strings(self.sectors[self.data_index], strings)
+        with phase('tjs2.export.join') as timed:
+            data = merge_sectors(self.sectors)
+            timed.nbytes = len(data)
+        return data
+
+    def write_strings(self, strings, output):
+        """ Writes the exported file to a path (see `write_via_temp`) or binary
+        stream without joining it first. """
+        if is_path(output):
+            return write_via_temp(output, lambda o: self.write_strings(strings, o))
+        with phase('tjs2.strings.encode', strings=len(strings)):
+            set_strings(self.sectors[self.data_index], strings)
+        with phase('tjs2.write') as timed:
+            written = write_sectors(self.sectors, output)
+            timed.nbytes = written
+        return written
 
 
 if __name__ == '__main__':
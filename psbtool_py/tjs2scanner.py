@@ -0,0 +1,251 @@
+import struct
+from array import array
+from enum import IntEnum
+from .scanner import StringReferenceIndex
+
+class VMCode(IntEnum):
+    """ TJS2 VM instruction codes, in the engine's numbering. """
+    NOP = 0
+    CONST = 1
+    CP = 2
+    CL = 3
+    CCL = 4
+    TT = 5
+    TF = 6
+    CEQ = 7
+    CDEQ = 8
+    CLT = 9
+    CGT = 10
+    SETF = 11
+    SETNF = 12
+    LNOT = 13
+    NF = 14
+    JF = 15
+    JNF = 16
+    JMP = 17
+    INC = 18
+    INCPD = 19
+    INCPI = 20
+    INCP = 21
+    DEC = 22
+    DECPD = 23
+    DECPI = 24
+    DECP = 25
+    # 14 binary operators, each as OP, OPPD, OPPI, OPP
+    LOR = 26
+    LAND = 30
+    BOR = 34
+    BXOR = 38
+    BAND = 42
+    SAR = 46
+    SAL = 50
+    SR = 54
+    ADD = 58
+    SUB = 62
+    MOD = 66
+    DIV = 70
+    IDIV = 74
+    MUL = 78
+    BNOT = 82
+    TYPEOF = 83
+    TYPEOFD = 84
+    TYPEOFI = 85
+    EVAL = 86
+    EEXP = 87
+    CHKINS = 88
+    ASC = 89
+    CHR = 90
+    NUM = 91
+    CHS = 92
+    INV = 93
+    CHKINV = 94
+    INT = 95
+    REAL = 96
+    STR = 97
+    OCTET = 98
+    CALL = 99
+    CALLD = 100
+    CALLI = 101
+    NEW = 102
+    GPD = 103
+    SPD = 104
+    SPDE = 105
+    SPDEH = 106
+    GPI = 107
+    SPI = 108
+    SPIE = 109
+    GPDS = 110
+    SPDS = 111
+    GPIS = 112
+    SPIS = 113
+    SETP = 114
+    GETP = 115
+    DELD = 116
+    DELI = 117
+    SRV = 118
+    RET = 119
+    ENTRY = 120
+    EXTRY = 121
+    THROW = 122
+    CHGTHIS = 123
+    GLOBAL = 124
+    ADDCI = 125
+    REGMEMBER = 126
+    DEBUGGER = 127
+
+# constant types of the code object data area
+TYPE_STRING = 3
+
+# use position of references that don't come from an instruction
+NO_OFFSET = 0xFFFFFFFF
+
+CODE_OBJECT_HEADER = struct.Struct('<12i')
+
+def build_instruction_table():
+    """ Returns (sizes, data operands) lists indexed by VM code.
+
+    Size 0 marks an unknown code, calls have a variable size (see
+    `instruction_size`) and data operands are the instruction words that
+    index the code object's constants.
+    """
+    sizes = [0] * 256
+    operands = [()] * 256
+
+    def put(codes, size, data_operand=None):
+        for code in codes:
+            sizes[code] = size
+            operands[code] = () if data_operand is None else (data_operand,)
+
+    put([VMCode.NOP, VMCode.NF, VMCode.RET, VMCode.EXTRY, VMCode.REGMEMBER, VMCode.DEBUGGER], 1)
+    put([VMCode.TT, VMCode.TF, VMCode.SETF, VMCode.SETNF, VMCode.LNOT, VMCode.BNOT,
+        VMCode.ASC, VMCode.CHR, VMCode.NUM, VMCode.CHS, VMCode.CL, VMCode.INV,
+        VMCode.CHKINV, VMCode.TYPEOF, VMCode.EVAL, VMCode.EEXP, VMCode.INT, VMCode.REAL,
+        VMCode.STR, VMCode.OCTET, VMCode.JF, VMCode.JNF, VMCode.JMP, VMCode.INC,
+        VMCode.DEC, VMCode.SRV, VMCode.THROW, VMCode.GLOBAL], 2)
+    put([VMCode.CP, VMCode.CEQ, VMCode.CDEQ, VMCode.CLT, VMCode.CGT, VMCode.CHKINS,
+        VMCode.CCL, VMCode.INCP, VMCode.DECP, VMCode.SETP, VMCode.GETP, VMCode.ENTRY,
+        VMCode.CHGTHIS, VMCode.ADDCI], 3)
+    put([VMCode.CONST], 3, 2)
+    put([VMCode.INCPI, VMCode.DECPI, VMCode.TYPEOFI, VMCode.DELI, VMCode.GPI, VMCode.GPIS,
+        VMCode.SPI, VMCode.SPIE, VMCode.SPIS], 4)
+    put([VMCode.INCPD, VMCode.DECPD, VMCode.TYPEOFD, VMCode.DELD, VMCode.GPD, VMCode.GPDS], 4, 3)
+    put([VMCode.SPD, VMCode.SPDE, VMCode.SPDEH, VMCode.SPDS], 4, 2)
+    for base in range(VMCode.LOR, VMCode.MUL + 1, 4):
+        put([base], 3)
+        put([base + 1], 5, 3) # %r, %r.*d, %r
+        put([base + 2], 5)
+        put([base + 3], 4)
+    put([VMCode.CALL, VMCode.NEW], 4)
+    put([VMCode.CALLD], 5, 3)
+    put([VMCode.CALLI], 5)
+    return sizes, operands
+
+INSTRUCTION_SIZES, DATA_OPERANDS = build_instruction_table()
+
+def instruction_size(code, pos):
+    """ Size in words of the instruction at `pos`, 0 for an unknown or truncated one. """
+    op = code[pos]
+    size = INSTRUCTION_SIZES[op] if 0 <= op < 256 else 0
+    if op in (VMCode.CALL, VMCode.NEW, VMCode.CALLD, VMCode.CALLI) and pos + size <= len(code):
+        argc = code[pos + size - 1]
+        if argc == -2: # expanded arguments: count, then (type, register) pairs
+            if pos + size >= len(code):
+                return 0
+            size += 1 + code[pos + size] * 2
+        elif argc > 0:
+            size += argc
+    return size if pos + size <= len(code) else 0
+
+class CodeObject:
+    """ The parts of a TJS2 code object sector needed to follow its constant
+    references: header fields, instruction words and the (type, index) data area. """
+    def __init__(self, content):
+        (self.parent, self.name, self.context_type, self.max_variable_count,
+            self.variable_reserve_count, self.max_frame_count, self.func_decl_arg_count,
+            self.func_decl_unnamed_arg_array_base, self.func_decl_collapse_base,
+            self.prop_setter, self.prop_getter, self.super_class_getter) = CODE_OBJECT_HEADER.unpack_from(content, 0)
+        pos = CODE_OBJECT_HEADER.size
+        source_positions = struct.unpack_from('<i', content, pos)[0]
+        pos += 4 + source_positions * 8
+
+        code_count = struct.unpack_from('<i', content, pos)[0]
+        pos += 4
+        self.code = array('h', bytes(content[pos:pos + code_count * 2]))
+        if len(self.code) != code_count:
+            raise Exception("Truncated TJS2 code object")
+        pos += (code_count * 2 + 3) & ~3
+
+        data_count = struct.unpack_from('<i', content, pos)[0]
+        pos += 4
+        data = bytes(content[pos:pos + data_count * 4])
+        if len(data) != data_count * 4:
+            raise Exception("Truncated TJS2 code object")
+        self.data_types = array('h', data)[0::2]
+        # indexes past 0x7FFF only make sense unsigned
+        self.data_indexes = array('H', data)[1::2]
+        self.complete = True
+
+    def string_constant(self, slot):
+        """ String table index held by data slot `slot`, or None. """
+        if 0 <= slot < len(self.data_types) and self.data_types[slot] == TYPE_STRING:
+            return self.data_indexes[slot]
+        return None
+
+    def iter_string_uses(self):
+        """ Yields (instruction offset, string index) in code order.
+
+        Stops early at an unknown instruction, in which case `complete`
+        is False afterwards.
+        """
+        code = self.code
+        self.complete = True
+        pos = 0
+        while pos < len(code):
+            size = instruction_size(code, pos)
+            if not size:
+                self.complete = False
+                return
+            for operand in DATA_OPERANDS[code[pos]]:
+                string_id = self.string_constant(code[pos + operand])
+                if string_id is not None:
+                    yield pos, string_id
+            pos += size
+
+class TJS2ReferenceIndex(StringReferenceIndex):
+    """ `StringReferenceIndex` over the code objects of a TJS2 file.
+
+    Built in one pass over the objects in file order; `order` is execution
+    order within each object. Object names count as uses without an
+    instruction offset, and so do the string constants of an object whose
+    code could not be decoded to the end.
+    """
+    def __init__(self, string_count, objects):
+        ids = []
+        positions = []
+        for index, obj in enumerate(objects):
+            base = index << 32
+            if 0 <= obj.name < string_count:
+                ids.append(obj.name)
+                positions.append(base | NO_OFFSET)
+            for offset, string_id in obj.iter_string_uses():
+                ids.append(string_id)
+                positions.append(base | offset)
+            if not obj.complete:
+                for slot in range(len(obj.data_types)):
+                    string_id = obj.string_constant(slot)
+                    if string_id is not None:
+                        ids.append(string_id)
+                        positions.append(base | NO_OFFSET)
+        super().__init__(string_count, ids, positions)
+        self.objects = objects
+
+    @classmethod
+    def from_sectors(cls, string_count, sectors):
+        return cls(string_count, [CodeObject(sector.content) for sector in sectors if sector.type == "TJS2"])
+
+    def uses(self, string_id):
+        """ (code object index, instruction offset or NO_OFFSET) of every use of a string. """
+        return [(position >> 32, position & NO_OFFSET) for position in super().uses(string_id)]
+
+    def objects_using(self, string_id):
+        return sorted({position >> 32 for position in super().uses(string_id)})
@@ -1,4 +1,7 @@
 from psbtool_py.tjs2manager import TJS2SManager
+from psbtool_py.batch import run_batch, run_incremental_batch, exit_status, memory_estimate
+from psbtool_py.manifest import PackManifest
+from psbtool_py.profiling import phase, report_profile
 from glob import glob
 import os, sys
 from filetranslate.service_fn import read_csv_list, write_csv_list
@@ -8,6 +11,8 @@ STRINGS_NAME = "strings"
 ATTRIBUTES_NAME = "attributes"
 STRINGS_DB_POSTFIX = "_" + STRINGS_NAME + ".csv"
 DEF_OUT_DIR = 'translation_out'
+# pack peaks at about 7 times the file size, unpack at about 3
+MEMORY_FACTOR = 8
 
 def make_postfixed_name(name, postfix):
     return os.path.join(os.path.dirname(name), os.path.basename(name) + postfix)
@@ -16,70 +21,110 @@ def remove_ext(name):
     name = name.split('.')
     return '.'.join(name[:-1])
 
+def translations_name(name, ext=''):
+    return make_postfixed_name(remove_ext(name), ext + STRINGS_DB_POSTFIX)
+
 def read_string_translations(name, ext=''):
-    name = remove_ext(name)
-    name = make_postfixed_name(name, ext + STRINGS_DB_POSTFIX)
-    return read_csv_list(name)
+    with phase('csv.read'):
+        return read_csv_list(translations_name(name, ext))
+
+def output_name(fn, out_dir):
+    return os.path.abspath(os.path.abspath(fn).replace(os.getcwd(), out_dir))
+
+def build_translation_index(fncsv):
+    """ Maps every source string to its first non-commented, non-empty translation. """
+    index = {}
+    for line in fncsv:
+        if len(line) > 1 and line[0][:2] != "//" and line[1].strip() != "" and line[0] not in index:
+            index[line[0]] = line[1]
+    return index
+
+_shared_indexes = {}
+
+def load_translation_index(csv_name):
+    """ Builds the index of a CSV shared by many files once per process. """
+    key = os.path.abspath(csv_name)
+    stat = os.stat(key)
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _shared_indexes.get(key)
+    if cached is None or cached[0] != version:
+        with phase('csv.read', stat.st_size):
+            cached = (version, build_translation_index(read_csv_list(key)))
+        _shared_indexes[key] = cached
+    return cached[1]
 
-def pack_function(scenarios, out_dir):
-    cwd = os.getcwd()
-    for fn in glob(scenarios):
+def pack_file(fn, out_dir, shared_csv=None):
+    if shared_csv:
+        fncsv = None
+        index = load_translation_index(shared_csv)
+        if not index: return None
+    else:
         fncsv = read_string_translations(fn)
-        if not fncsv: continue
-        ofn = os.path.abspath(os.path.abspath(fn).replace(os.getcwd(), out_dir))
-        if out_dir != DEF_OUT_DIR:
-            print(f"Translating to {ofn} ... ")
+        if not fncsv: return None
+        index = None
+    ofn = output_name(fn, out_dir)
+    if os.path.exists(ofn) and os.path.samefile(fn, ofn):
+        # packing in place: a mapped source can't be replaced on every OS
+        with open(fn,'rb') as f: a = TJS2SManager(f.read())
+    else: a = TJS2SManager.from_file(fn)
+    so = a.import_strings()
+    if fncsv is not None:
+        try:
+            i_empty = so.index('')
+            fncsv.insert(i_empty, ['', ''])
+        except:
+            pass
+    full_index_mode = False
+    if fncsv is not None and len(fncsv) == len(so) and all(
+            row[0] == s or row[0][:2] == "//" for row, s in zip(fncsv, so)):
+        full_index_mode = True
+    elif index is None:
+        index = build_translation_index(fncsv)
+    for i, s in enumerate(so):
+        if not s: continue
+        #print(fncsv[i][0], so[i])
+        if full_index_mode:
+            if fncsv[i][0][:2] != "//" and fncsv[i][1].strip() != "":
+                so[i] = fncsv[i][1]
         else:
-            print(f"Translating {fn.replace(cwd, '')} ... ")
-        ofn_dir = ''
-        with open(fn, 'rb') as f:
-            a = TJS2SManager(f)
-            so = a.import_strings()
-            try:
-                i_empty = so.index('')
-                fncsv.insert(i_empty, ['', ''])
-            except:
-                pass
-            full_index_mode = False
-            if len(fncsv) == len(so):
-                full_index_mode = True
-            for i, s in enumerate(so):
-                if not s: continue
-                #print(fncsv[i][0], so[i])
-                if full_index_mode:
-                    if fncsv[i][0][:2] != "//" and fncsv[i][1].strip() != "":
-                        so[i] = fncsv[i][1]
-                else:
-                    for line in fncsv:
-                        if line[0][:2] != "//" and len(line) > 1 and line[1].strip() != "" and line[0] == so[i]:
-                            so[i] = line[1]
-                            break
-            if ofn_dir != os.path.dirname(ofn):
-                ofn_dir = os.path.dirname(ofn)
-                if ofn_dir != '' and not os.path.exists(ofn_dir):
-                    os.makedirs(ofn_dir, exist_ok=True)
-            with open(ofn, 'wb') as o:
-                o.write(a.export_strings(so))
-                pass
-        pass
-
-def unpack_function(scenarios):
-    cwd = os.getcwd()
-    for fn in glob(scenarios):
-        fncsv = make_postfixed_name(os.path.splitext(fn)[0], STRINGS_DB_POSTFIX)
-        if os.path.isfile(fncsv): continue
-        print(f"Parsing {fn.replace(cwd, '')} ... ", end='')
-        with open(fn, 'rb') as f:
-            so = []
-            s = []
-            a = TJS2SManager(f)
-            so = a.import_strings()
-            for i in so:
-                if not i: continue
-                s.append([i, ''])
-            write_csv_list(fncsv, s)
-            print(f"{len(so)} strings")
-        pass
+            so[i] = index.get(s, s)
+    ofn_dir = os.path.dirname(ofn)
+    if ofn_dir != '' and not os.path.exists(ofn_dir):
+        os.makedirs(ofn_dir, exist_ok=True)
+    a.write_strings(so, ofn)
+    return f"translated to {ofn}" if out_dir != DEF_OUT_DIR else "translated"
+
+def unpack_file(fn, exec_order=False):
+    fncsv = make_postfixed_name(os.path.splitext(fn)[0], STRINGS_DB_POSTFIX)
+    if os.path.isfile(fncsv): return None
+    s = []
+    a = TJS2SManager.from_file(fn)
+    so = a.import_strings()
+    if exec_order:
+        # only the constants the code uses, in the order it uses them
+        references = a.build_references()
+        used = [so[i] for i in references.order[:references.referenced_count]]
+    else:
+        used = so
+    for i in used:
+        if not i: continue
+        s.append([i, ''])
+    with phase('csv.write', strings=len(s)):
+        write_csv_list(fncsv, s)
+    if exec_order:
+        return f"{len(used)} of {len(so)} strings"
+    return f"{len(so)} strings"
+
+def pack_function(scenarios, out_dir, jobs=1, force=False, shared_csv=None, profile=False, memory_budget=None,
+        memory_factor=MEMORY_FACTOR):
+    manifest = PackManifest(out_dir, 'tjs_tool')
+    inputs_of = lambda fn: (shared_csv or translations_name(fn), output_name(fn, out_dir))
+    return run_incremental_batch(pack_file, glob(scenarios), manifest, inputs_of, (out_dir, shared_csv), jobs, force,
+        profile=profile, memory_budget=memory_budget, memory_of=lambda fn: memory_estimate(fn, memory_factor))
+
+def unpack_function(scenarios, jobs=1, exec_order=False, profile=False, memory_budget=None, memory_factor=MEMORY_FACTOR):
+    return run_batch(unpack_file, glob(scenarios), (exec_order,), jobs, profile=profile,
+        memory_budget=memory_budget, memory_of=lambda fn: memory_estimate(fn, memory_factor))
 
 def main():
     if len(sys.argv) > 1:
@@ -89,14 +134,29 @@ def main():
         parser.add_argument('command', choices=['pack', 'unpack'], help='Command to run')
         parser.add_argument('path', nargs='?', default=TJS_PATHS, help='Files mask')
         parser.add_argument('-od', default=DEF_OUT_DIR, help='Files mask')
+        parser.add_argument('-j', '--jobs', type=int, default=1, help='Worker processes (0 = one per CPU)')
+        parser.add_argument('--force', action='store_true', help='Rebuild even unchanged files')
+        parser.add_argument('--csv', default=None, help='Translations CSV shared by all files (matched by content)')
+        parser.add_argument('--exec-order', action='store_true', help='Unpack only strings used by the code, in execution order')
+        parser.add_argument('--profile', nargs='?', const='', default=None, metavar='JSON',
+            help='Print per-phase time, bytes, strings and memory peaks; optionally save them as JSON')
+        parser.add_argument('--memory-budget', type=float, default=None, metavar='MB',
+            help='Start files only while their estimated memory use fits in this budget')
+        parser.add_argument('--memory-factor', type=float, default=MEMORY_FACTOR,
+            help='Estimated memory use of a file per byte of it (default %(default)s)')
         args = parser.parse_args()
+        profile = args.profile is not None
+        budget = int(args.memory_budget * 1e6) if args.memory_budget else None
 
         if args.command == 'pack':
-            pack_function(args.path, args.od)
+            results = pack_function(args.path, args.od, args.jobs, args.force, args.csv, profile, budget, args.memory_factor)
         elif args.command == 'unpack':
-            unpack_function(args.path)
+            results = unpack_function(args.path, args.jobs, args.exec_order, profile, budget, args.memory_factor)
+        if profile:
+            report_profile(results, args.profile)
     else:
-        pack_function(TJS_PATHS, DEF_OUT_DIR)
+        results = pack_function(TJS_PATHS, DEF_OUT_DIR)
+    return exit_status(results)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())
\ No newline at end of file